@@ -0,0 +1,308 @@
+"""
+
+    Recommendation latency and memory benchmark.
+
+    Author: Explore Data Science Academy.
+
+    Description: Generates synthetic MovieLens-shaped `movies.csv` and
+    `ratings.csv` files at the requested scales, trains a small stand-in
+    SVD model on them (so no `SVD.pkl` is needed) and measures, for both
+    `content_model` and `collab_model`:
+
+      - cold import time, in a fresh process building all caches,
+      - warm import time, in a second process reusing those caches,
+      - first-call and warm-call latency (p50/p95/p99),
+      - peak traced memory (tracemalloc) and peak RSS.
+
+    Each measurement runs in its own subprocess whose working directory
+    is a generated workspace, so the recommenders load the synthetic
+    data exactly as the app loads the real data. Results are written as
+    JSON; pass `--compare` with an earlier results file to print the
+    change of every metric between two commits.
+
+    Usage:
+
+        python benchmarks/bench_recommenders.py --scale 10000:100000 \
+            --scale 100000:1000000 --calls 50
+
+"""
+# Dependencies
+import argparse
+import datetime
+import json
+import os
+import pickle
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+RESULTS_PATH = os.path.join(ROOT, 'benchmarks', 'results')
+GENRES = ['Action', 'Adventure', 'Animation', 'Children', 'Comedy', 'Crime',
+          'Documentary', 'Drama', 'Fantasy', 'Film-Noir', 'Horror', 'IMAX',
+          'Musical', 'Mystery', 'Romance', 'Sci-Fi', 'Thriller', 'War',
+          'Western']
+RECOMMENDERS = {
+    'content': ('recommenders.content_based', 'content_model'),
+    'collaborative': ('recommenders.collaborative_based', 'collab_model'),
+}
+
+def generate_movies(n_movies, rng):
+    """Generate a synthetic movie catalogue.
+
+    Parameters
+    ----------
+    n_movies : int
+        Number of movies.
+    rng : np.random.Generator
+        Source of randomness.
+
+    Returns
+    -------
+    Pandas Dataframe
+        `movieId`, `title` and `genres` columns shaped like movies.csv.
+
+    """
+    years = rng.integers(1920, 2020, n_movies)
+    n_genres = rng.integers(1, 4, n_movies)
+    picks = rng.integers(0, len(GENRES), (n_movies, 3))
+    genres = ['|'.join(sorted({GENRES[g] for g in row[:k]}))
+              for row, k in zip(picks.tolist(), n_genres.tolist())]
+    return pd.DataFrame({
+        'movieId': np.arange(1, n_movies + 1),
+        'title': [f'Movie {i} ({year})' for i, year in
+                  enumerate(years.tolist(), start=1)],
+        'genres': genres,
+    })
+
+def generate_ratings(n_ratings, n_movies, rng):
+    """Generate synthetic ratings with a long-tailed item popularity.
+
+    Parameters
+    ----------
+    n_ratings : int
+        Number of ratings to draw; repeated (user, movie) pairs are
+        dropped, so slightly fewer may be returned.
+    n_movies : int
+        Size of the catalogue the ratings refer to.
+    rng : np.random.Generator
+        Source of randomness.
+
+    Returns
+    -------
+    Pandas Dataframe
+        `userId`, `movieId`, `rating` and `timestamp` columns shaped like
+        ratings.csv.
+
+    """
+    n_users = max(10, n_ratings // 100)
+    popularity = 1.0 / np.arange(1, n_movies + 1) ** 0.8
+    ratings = pd.DataFrame({
+        'userId': rng.integers(1, n_users + 1, n_ratings),
+        'movieId': rng.choice(n_movies, n_ratings,
+                              p=popularity / popularity.sum()) + 1,
+        'rating': rng.integers(1, 11, n_ratings) / 2.0,
+        'timestamp': rng.integers(8.0e8, 1.5e9, n_ratings),
+    })
+    return ratings.drop_duplicates(['userId', 'movieId'], ignore_index=True)
+
+def train_stand_in_model(ratings, save_path, max_ratings=500000, seed=0):
+    """Fit and pickle a small SVD model in place of `SVD.pkl`.
+
+    Parameters
+    ----------
+    ratings : Pandas Dataframe
+        Ratings to fit; a random sample of `max_ratings` is used for
+        larger data sets.
+    save_path : str
+        Destination of the pickled model.
+    max_ratings : int
+        Upper bound on the number of ratings the model is fitted on.
+    seed : int
+        Seed of the sample and of the model initialisation.
+
+    """
+    import surprise
+
+    if len(ratings) > max_ratings:
+        ratings = ratings.sample(max_ratings, random_state=seed)
+    data = surprise.Dataset.load_from_df(
+        ratings[['userId', 'movieId', 'rating']],
+        surprise.Reader(rating_scale=(0.5, 5)))
+    model = surprise.SVD(n_factors=20, n_epochs=5, random_state=seed)
+    model.fit(data.build_full_trainset())
+    with open(save_path, 'wb') as model_file:
+        pickle.dump(model, model_file)
+
+def build_workspace(folder, n_movies, n_ratings, seed=0):
+    """Lay out a synthetic data set the way the app expects it on disk.
+
+    Parameters
+    ----------
+    folder : str
+        Workspace root; `resources/data` and `resources/models` are
+        created inside it.
+    n_movies : int
+        Number of movies.
+    n_ratings : int
+        Number of ratings.
+    seed : int
+        Seed of the generated data.
+
+    Returns
+    -------
+    list (list (str))
+        Query lists of three titles which have all been rated.
+
+    """
+    rng = np.random.default_rng(seed)
+    data_dir = os.path.join(folder, 'resources', 'data')
+    model_dir = os.path.join(folder, 'resources', 'models')
+    os.makedirs(data_dir)
+    os.makedirs(model_dir)
+    movies = generate_movies(n_movies, rng)
+    ratings = generate_ratings(n_ratings, n_movies, rng)
+    movies.to_csv(os.path.join(data_dir, 'movies.csv'), index=False)
+    ratings.to_csv(os.path.join(data_dir, 'ratings.csv'), index=False)
+    train_stand_in_model(ratings, os.path.join(model_dir, 'SVD.pkl'), seed=seed)
+    rated = movies.set_index('movieId').loc[ratings['movieId'].unique(), 'title']
+    return [rated.sample(3, random_state=seed + i).tolist() for i in range(20)]
+
+def run_child(module_name, function_name, queries, n_calls, trace_memory):
+    """Measure one recommender inside the current (fresh) process."""
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    module = __import__(module_name, fromlist=[function_name])
+    import_seconds = time.perf_counter() - start
+    model = getattr(module, function_name)
+
+    start = time.perf_counter()
+    model(movie_list=queries[0], top_n=10)
+    first_call = time.perf_counter() - start
+    latencies = []
+    for i in range(n_calls):
+        start = time.perf_counter()
+        model(movie_list=queries[i % len(queries)], top_n=10)
+        latencies.append(time.perf_counter() - start)
+
+    result = {
+        'import_s': import_seconds,
+        'first_call_ms': 1000 * first_call,
+        'p50_ms': 1000 * float(np.percentile(latencies, 50)),
+        'p95_ms': 1000 * float(np.percentile(latencies, 95)),
+        'p99_ms': 1000 * float(np.percentile(latencies, 99)),
+        # ru_maxrss is reported in kilobytes on Linux.
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+    if trace_memory:
+        result['peak_traced_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    print(json.dumps(result))
+
+def measure(workspace, recommender, queries, n_calls, trace_memory):
+    """Run `run_child` in a subprocess inside `workspace`."""
+    module_name, function_name = RECOMMENDERS[recommender]
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    command = [sys.executable, os.path.abspath(__file__), '--child',
+               json.dumps([module_name, function_name, queries, n_calls,
+                           trace_memory])]
+    output = subprocess.run(command, cwd=workspace, env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def benchmark_scale(n_movies, n_ratings, n_calls, trace_memory, seed=0):
+    """Benchmark both recommenders on one synthetic data set."""
+    with tempfile.TemporaryDirectory(prefix='recbench-') as workspace:
+        start = time.perf_counter()
+        queries = build_workspace(workspace, n_movies, n_ratings, seed)
+        results = {'n_movies': n_movies, 'n_ratings': n_ratings,
+                   'generate_s': time.perf_counter() - start}
+        for recommender in RECOMMENDERS:
+            cold = measure(workspace, recommender, queries, n_calls,
+                           trace_memory)
+            warm = measure(workspace, recommender, queries, n_calls,
+                           trace_memory)
+            warm['cold_import_s'] = cold['import_s']
+            warm['warm_import_s'] = warm.pop('import_s')
+            results[recommender] = warm
+            print(f"{n_movies:>9} movies {n_ratings:>10} ratings "
+                  f"{recommender:<14} cold import {cold['import_s']:.2f}s "
+                  f"p50 {warm['p50_ms']:.2f}ms p99 {warm['p99_ms']:.2f}ms "
+                  f"rss {warm['peak_rss_mb']:.0f}MB", file=sys.stderr)
+    return results
+
+def git_revision():
+    """Current commit of the repository, if available."""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              check=True, capture_output=True,
+                              text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def compare(old, new):
+    """Print the relative change of every metric between two runs."""
+    old_runs = {(run['n_movies'], run['n_ratings']): run for run in old['runs']}
+    for run in new['runs']:
+        before = old_runs.get((run['n_movies'], run['n_ratings']))
+        if before is None:
+            continue
+        for recommender in RECOMMENDERS:
+            for metric, value in run[recommender].items():
+                previous = before.get(recommender, {}).get(metric)
+                if previous:
+                    print(f"{run['n_movies']:>9}/{run['n_ratings']:<10} "
+                          f"{recommender:<14}{metric:<16}{previous:>10.2f} -> "
+                          f"{value:>10.2f} ({100 * (value / previous - 1):+.1f}%)")
+
+def parse_scale(text):
+    n_movies, n_ratings = text.split(':')
+    return int(float(n_movies)), int(float(n_ratings))
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] == '--child':
+        run_child(*json.loads(sys.argv[2]))
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark the recommenders on synthetic data.')
+    parser.add_argument('--scale', type=parse_scale, action='append',
+                        metavar='MOVIES:RATINGS',
+                        help='Data set size, e.g. 10000:100000 or 1e6:25e6. '
+                             'May be repeated.')
+    parser.add_argument('--calls', type=int, default=50,
+                        help='Warm calls per recommender.')
+    parser.add_argument('--no-tracemalloc', action='store_true',
+                        help='Skip tracemalloc, which slows down the timed code.')
+    parser.add_argument('--output', help='Results file; defaults to '
+                        'benchmarks/results/<date>-<commit>.json.')
+    parser.add_argument('--compare', help='Earlier results file to compare with.')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    revision = git_revision()
+    report = {'revision': revision,
+              'date': datetime.datetime.now().isoformat(timespec='seconds'),
+              'python': sys.version.split()[0],
+              'tracemalloc': not args.no_tracemalloc,
+              'runs': [benchmark_scale(n_movies, n_ratings, args.calls,
+                                       not args.no_tracemalloc, args.seed)
+                       for n_movies, n_ratings in
+                       args.scale or [(10000, 100000)]]}
+    output = args.output or os.path.join(
+        RESULTS_PATH, '{}-{}.json'.format(
+            datetime.datetime.now().strftime('%Y%m%d-%H%M%S'), revision))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as results_file:
+        json.dump(report, results_file, indent=2)
+    print(f"Results written to {output}")
+    if args.compare:
+        with open(args.compare) as previous_file:
+            compare(json.load(previous_file), report)
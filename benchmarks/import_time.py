@@ -0,0 +1,113 @@
+"""
+
+    Import-time breakdown of the app and the recommenders.
+
+    Author: Explore Data Science Academy.
+
+    Description: Imports each target module in a fresh interpreter run
+    with `python -X importtime`, and reports the total wall time of the
+    import together with the modules (cumulative time) and top-level
+    packages (self time) it was spent in. Importing a recommender also
+    loads its data, index and model, so this measures the cold start of
+    each part of the app. Results can be written as JSON and compared
+    with an earlier run to spot startup regressions.
+
+    Usage:
+
+        python benchmarks/import_time.py --top 15
+        python benchmarks/import_time.py --output before.json
+        python benchmarks/import_time.py --compare before.json
+
+"""
+# Dependencies
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+TARGETS = ['utils.app_cache', 'recommenders.content_based',
+           'recommenders.collaborative_based', 'recommenders.hybrid']
+
+def import_profile(module_name):
+    """Import a module in a fresh interpreter and parse `-X importtime`.
+
+    Parameters
+    ----------
+    module_name : str
+        Module to import, from the repository root.
+
+    Returns
+    -------
+    dict
+        Wall time of the import (s), and the self and cumulative import
+        time (s) of every module imported along the way.
+
+    """
+    code = ('import time; start = time.perf_counter(); '
+            f'import {module_name}; '
+            'print("WALL", time.perf_counter() - start)')
+    environment = dict(os.environ, PYTHONPATH=ROOT)
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                               cwd=ROOT, env=environment, capture_output=True,
+                               text=True, check=True)
+    wall = float(completed.stdout.split('WALL')[-1])
+    modules = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(self_us) / 1e6, int(cumulative_us) / 1e6)
+    return {'wall': wall, 'modules': modules}
+
+def summarise(profile, top):
+    """Slowest modules and packages of one import profile."""
+    modules = profile['modules']
+    packages = {}
+    for name, (self_time, _) in modules.items():
+        package = name.split('.')[0]
+        packages[package] = packages.get(package, 0.0) + self_time
+    slowest = sorted(modules.items(), key=lambda item: -item[1][1])[:top]
+    return {'wall_s': round(profile['wall'], 3),
+            'packages_s': {name: round(seconds, 3) for name, seconds in
+                           sorted(packages.items(), key=lambda item: -item[1])[:top]},
+            'modules_cumulative_s': {name: round(times[1], 3)
+                                     for name, times in slowest}}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Report where the app spends its import time.')
+    parser.add_argument('targets', nargs='*', default=TARGETS,
+                        help='Modules to import; defaults to the app modules.')
+    parser.add_argument('--top', type=int, default=10,
+                        help='Number of modules and packages listed.')
+    parser.add_argument('--output', help='Write the results to a JSON file.')
+    parser.add_argument('--compare', help='Earlier results file to compare with.')
+    args = parser.parse_args()
+
+    results = {'date': time.strftime('%Y-%m-%dT%H:%M:%S'), 'targets': {}}
+    for target in args.targets:
+        summary = summarise(import_profile(target), args.top)
+        results['targets'][target] = summary
+        print(f"\n{target}: {summary['wall_s']:.2f}s")
+        print('  by package (self time):')
+        for name, seconds in summary['packages_s'].items():
+            print(f'    {name:<40} {seconds:8.3f}s')
+        print('  slowest modules (cumulative):')
+        for name, seconds in summary['modules_cumulative_s'].items():
+            print(f'    {name:<40} {seconds:8.3f}s')
+    if args.compare:
+        with open(args.compare) as earlier_file:
+            earlier = json.load(earlier_file)['targets']
+        print('\nChange in wall time:')
+        for target, summary in results['targets'].items():
+            if target in earlier:
+                before = earlier[target]['wall_s']
+                change = (summary['wall_s'] - before) / before * 100 if before else 0
+                print(f"  {target:<40} {before:8.3f}s -> "
+                      f"{summary['wall_s']:8.3f}s ({change:+.1f}%)")
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
@@ -0,0 +1,125 @@
+"""
+
+    Load test of the headless recommendation service.
+
+    Author: Explore Data Science Academy.
+
+    Description: Sends recommendation requests for random favourite-movie
+    lists to a running `recommenders.service` from a growing number of
+    concurrent clients, and reports the throughput and latency
+    percentiles (p50/p95/p99) reached at each concurrency level. Each
+    client thread reuses pooled connections through `RecommenderClient`.
+
+    Usage:
+
+        python -m recommenders.service --port 8600 &
+        python benchmarks/load_test.py --url http://127.0.0.1:8600 \
+            --concurrency 1 4 16 64 --requests 500 --algorithm content
+
+"""
+# Dependencies
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from utils.service_client import RecommenderClient
+
+def sample_queries(movies_path, n_queries, list_size=3, seed=0):
+    """Draw random favourite-movie lists from the catalogue."""
+    titles = pd.read_csv(movies_path, usecols=['title'])['title'].to_numpy()
+    rng = np.random.default_rng(seed)
+    return [titles[rng.choice(len(titles), list_size, replace=False)].tolist()
+            for _ in range(n_queries)]
+
+def run_level(client, algorithm, queries, concurrency, top_n):
+    """Send all queries from `concurrency` threads.
+
+    Returns
+    -------
+    dict
+        Throughput, error count and latency percentiles of the level.
+
+    """
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    position = iter(range(len(queries)))
+
+    def worker():
+        while True:
+            with lock:
+                index = next(position, None)
+            if index is None:
+                return
+            start = time.perf_counter()
+            try:
+                client.recommend(algorithm, queries[index], top_n)
+            except Exception as error:
+                with lock:
+                    errors.append(repr(error))
+                continue
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+    latencies_ms = np.array(latencies) * 1000
+    result = {'concurrency': concurrency,
+              'requests': len(queries),
+              'errors': len(errors),
+              'throughput_rps': round(len(latencies) / wall, 1)}
+    if len(latencies_ms):
+        for percentile in (50, 95, 99):
+            result[f'p{percentile}_ms'] = round(
+                float(np.percentile(latencies_ms, percentile)), 2)
+    return result
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Measure the throughput of the recommendation service.')
+    parser.add_argument('--url', default='http://127.0.0.1:8600')
+    parser.add_argument('--algorithm', default='content',
+                        choices=['content', 'collaborative', 'hybrid'])
+    parser.add_argument('--concurrency', type=int, nargs='+',
+                        default=[1, 4, 16, 64])
+    parser.add_argument('--requests', type=int, default=500,
+                        help='Requests sent at each concurrency level.')
+    parser.add_argument('--top-n', type=int, default=10)
+    parser.add_argument('--movies', default=os.path.join(
+        ROOT, 'resources', 'data', 'movies.csv'))
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    client = RecommenderClient(args.url, pool_size=max(args.concurrency))
+    if not client.health():
+        sys.exit(f'No recommendation service answering at {args.url}')
+    queries = sample_queries(args.movies, args.requests, seed=args.seed)
+    # Warm up the service before timing.
+    run_level(client, args.algorithm, queries[:10], 1, args.top_n)
+    results = []
+    print(f"{'clients':>8} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} "
+          f"{'p99 ms':>9} {'errors':>7}")
+    for concurrency in args.concurrency:
+        result = run_level(client, args.algorithm, queries, concurrency,
+                           args.top_n)
+        results.append(result)
+        print(f"{concurrency:>8} {result['throughput_rps']:>9} "
+              f"{result.get('p50_ms', '-'):>9} {result.get('p95_ms', '-'):>9} "
+              f"{result.get('p99_ms', '-'):>9} {result['errors']:>7}")
+    print(json.dumps({'algorithm': args.algorithm, 'url': args.url,
+                      'levels': results}))
@@ -27,76 +27,94 @@
 """
 # Streamlit dependencies
 import streamlit as st
-import requests
-import base64
-import re as reg
 
 # Data handling dependencies
 import pandas as pd
 import numpy as np
 
 # Custom Libraries
-from utils.data_loader import load_movie_titles
-from recommenders.collaborative_based import collab_model
-from recommenders.content_based import content_model
+from utils.app_cache import (background_css, cached_movie_titles,
+                             recommendation_cache, start_warm_up,
+                             title_search_index)
+from utils.metadata import get_metadata_service
+from utils.tracing import reported_errors, request_trace, span, traced
+# Cached wrappers of the recommenders' `*_model` functions
+from utils.app_cache import collab_model, content_model, hybrid_model
 
 # other app page details
 from utils.faq import faq
 from utils.about import about_us
 
+# Recommenders load in the background while the first page renders.
+start_warm_up()
+
 # Data Loading
-title_list = load_movie_titles('resources/data/movies.csv')
+title_list = cached_movie_titles('resources/data/movies.csv')
+
+def title_options(label, default_titles, limit=50):
+    """Typeahead over the full catalogue for one movie selection widget.
+
+    Renders a search box; while it is empty, `default_titles` are offered.
+
+    Parameters
+    ----------
+    label : str
+        Label of the selection widget the options are for.
+    default_titles : list (str)
+        Titles offered before anything is typed.
+    limit : int
+        Number of search matches offered.
+
+    Returns
+    -------
+    list (str)
+        Options for the selection widget.
+
+    """
+    query = st.text_input(f'Search titles ({label})', key=f'search {label}',
+                          placeholder='Start typing a movie title...')
+    if not query:
+        return default_titles
+    with span('title_search', query=query):
+        matches = title_search_index('resources/data/movies.csv').search(query, limit)
+    if not matches:
+        st.caption('No matching titles found.')
+        return default_titles
+    return matches
 
 dataset = st.container()
 
 # App declaration
 def main():
+    @traced()
     def clean_movie_titles(titles):
-        api_key = "87d991ea"
-
-        # Define a regular expression to match non-alphabetical characters
-        regex = reg.compile('[^a-zA-Z ]')
-
-        # Clean each title in the list by removing non-alphabetical characters
-        for title in titles:
-            cleaned_title = regex.sub('', title)
-            if cleaned_title:
-                try:
-                    url = f"http://www.omdbapi.com/?t={cleaned_title}&apikey={api_key}"
-                    re = requests.get(url)
-                    re = re.json()
-                    
+        with reported_errors('clean_movie_titles'):
+            metadata_service = get_metadata_service()
+            # Reserve a slot per title so cards keep their ranking order while
+            # being rendered as soon as each lookup completes.
+            slots = [st.empty() for _ in titles]
+            for position, title, re in metadata_service.fetch_many(titles):
+                # Titles which are invalid or cannot be found in the IMDB
+                # database are skipped
+                if not re:
+                    continue
+                with span('render_card', title=title), slots[position].container():
                     col1, col2= st.columns([1, 2])
                     with col1:
-                        st.image(re["Poster"])
+                        if re.get("Poster", "N/A") != "N/A":
+                            st.image(re["Poster"])
                     with col2:
-                        st.subheader(re["Title"])
-                        st.caption(f"GENRE: {re['Genre']}")
-                        st.caption(f"YEAR: {re['Year']}")
-                        st.caption(f"ACTORS: {re['Actors']}")
-                        st.write(re["Plot"])
+                        st.subheader(re.get("Title", title))
+                        st.caption(f"GENRE: {re.get('Genre', 'N/A')}")
+                        st.caption(f"YEAR: {re.get('Year', 'N/A')}")
+                        st.caption(f"ACTORS: {re.get('Actors', 'N/A')}")
+                        st.write(re.get("Plot", ""))
                         # st.progress(float(re['imdbRating']) / 10)
-                        st.text(f"IMDB Rating: {float(re['imdbRating'])}")
-                except:
-                    # we use pass only when the title is invalid or cannot be found IMDB database
-                    pass
+                        st.text(f"IMDB Rating: {re.get('imdbRating', 'N/A')}")
 
     def add_bg_from_local(image_file):
-        with open(image_file, "rb") as image_file:
-            encoded_string = base64.b64encode(image_file.read())
-        st.markdown(
-        f"""
-        <style>
-        .stApp {{
-            background-image: url(data:image/{"jpg"};base64,{encoded_string.decode()});
-            background-size: cover
-        }}
-        </style>
-        """,
-        unsafe_allow_html=True
-        )
-    
-    
+        st.markdown(background_css(image_file), unsafe_allow_html=True)
+
     # DO NOT REMOVE the 'Recommender System' option below, however,
     # you are welcome to add more options to enrich your app.
     page_options = ["Recommender System","Solution Overview", "About Us", "FAQ"]
@@ -122,13 +140,14 @@ def main():
         # Recommender System algorithm selection
         sys = st.radio("Select an algorithm",
                        ('Content Based Filtering',
-                        'Collaborative Based Filtering'))
+                        'Collaborative Based Filtering',
+                        'Hybrid Filtering'))
 
         # User-based preferences
         st.write('### Enter Your Three Favorite Movies')
-        movie_1 = st.selectbox('Fisrt Option',title_list[:799])
-        movie_2 = st.selectbox('Second Option',title_list[800:1599])
-        movie_3 = st.selectbox('Third Option',title_list[1600:2400])
+        movie_1 = st.selectbox('Fisrt Option',title_options('Fisrt Option',title_list[:799]))
+        movie_2 = st.selectbox('Second Option',title_options('Second Option',title_list[800:1599]))
+        movie_3 = st.selectbox('Third Option',title_options('Third Option',title_list[1600:2400]))
         fav_movies = [movie_1,movie_2,movie_3]
 
         # Perform top-10 movie recommendation generation
@@ -141,7 +160,7 @@ def main():
                     st.title("We think you'll like:")
                     clean_movie_titles(top_recommendations)
             
-                except:
+                except Exception:
                     st.error("Oops! Looks like this algorithm does't work.\
                               We'll need to fix it!")
 
@@ -155,7 +174,20 @@ def main():
                     st.title("We think you'll like:")
                     clean_movie_titles(top_recommendations)
                     
-                except:
+                except Exception:
+                    st.error("Oops! Looks like this algorithm does't work.\
+                              We'll need to fix it!")
+
+        if sys == 'Hybrid Filtering':
+            if st.button("Recommend"):
+                try:
+                    with st.spinner('Crunching the numbers...'):
+                        top_recommendations = hybrid_model(movie_list=fav_movies,
+                                                           top_n=13)
+                    st.title("We think you'll like:")
+                    clean_movie_titles(top_recommendations)
+
+                except Exception:
                     st.error("Oops! Looks like this algorithm does't work.\
                               We'll need to fix it!")
 
@@ -196,7 +228,22 @@ def main():
         st.markdown(faq[faq_select])
         
     st.sidebar.image("resources/imgs/main9.jpg", use_column_width=True)
+    with st.sidebar.expander("Recommendation cache"):
+        st.json(recommendation_cache().stats())
+
+def trace_panel(trace):
+    """Show the spans and errors of a traced app run in the sidebar."""
+    if trace is None or not (trace.spans or trace.errors):
+        return
+    with st.sidebar.expander("Request trace"):
+        st.caption(f"Total: {trace.duration_ms:.1f} ms")
+        st.dataframe(pd.DataFrame(trace.records()), hide_index=True)
+        for error in trace.errors:
+            st.code(error['traceback'])
+        if trace.profile_path:
+            st.caption(f"Profile: {trace.profile_path}")
 
-        
 if __name__ == '__main__':
-    main()
+    with request_trace('app_run') as trace:
+        main()
+    trace_panel(trace)
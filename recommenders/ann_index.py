@@ -0,0 +1,269 @@
+"""
+
+    Approximate nearest-neighbour search over SVD item factors.
+
+    Author: Explore Data Science Academy.
+
+    Description: An inverted-file (IVF) index written in pure NumPy. The
+    item vectors are normalised and clustered with spherical k-means;
+    a query only scores the items in its `n_probe` closest clusters.
+    Raising `n_probe` trades latency for recall, with `n_probe` equal to
+    the number of clusters being an exact (brute-force) search.
+
+    Run this file directly to build the index for `SVD.pkl` and report
+    its recall@k against brute-force search:
+
+        python -m recommenders.ann_index --k 10 --n-probe 1 4 8 16
+
+"""
+# Script dependencies
+import argparse
+import os
+import threading
+import time
+import numpy as np
+
+from recommenders.ranking import top_k
+
+def _normalise(vectors):
+    """Scale each row to unit length, leaving zero rows untouched."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+class IVFIndex:
+    """Inverted-file index for cosine similarity search.
+
+    Parameters
+    ----------
+    centroids : np.ndarray
+        Unit-length cluster centres, one row per inverted list.
+    list_offsets : np.ndarray
+        Start of each inverted list within `list_items`; list `c` holds
+        `list_items[list_offsets[c]:list_offsets[c + 1]]`.
+    list_items : np.ndarray
+        Item positions grouped by inverted list.
+    vectors : np.ndarray
+        Unit-length item vectors, one row per item position.
+    n_probe : int
+        Default number of inverted lists scanned per query.
+
+    """
+    def __init__(self, centroids, list_offsets, list_items, vectors, n_probe=8):
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_items = list_items
+        self.vectors = vectors
+        self.n_probe = n_probe
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, vectors, n_lists=None, n_iter=10, n_probe=None, seed=0):
+        """Cluster item vectors into an inverted-file index.
+
+        Parameters
+        ----------
+        vectors : np.ndarray
+            Item vectors, e.g. the SVD `qi` matrix.
+        n_lists : int, optional
+            Number of clusters. Defaults to the square root of the
+            number of items.
+        n_iter : int
+            Spherical k-means iterations.
+        n_probe : int, optional
+            Default number of clusters scanned per query. Defaults to a
+            third of the clusters.
+        seed : int
+            Seed for the choice of initial centroids.
+
+        Returns
+        -------
+        IVFIndex
+            The built index.
+
+        """
+        vectors = _normalise(vectors)
+        n_items = len(vectors)
+        if n_lists is None:
+            n_lists = max(1, int(np.sqrt(n_items)))
+        n_lists = min(n_lists, n_items)
+        if n_probe is None:
+            n_probe = max(1, n_lists // 3)
+        rng = np.random.default_rng(seed)
+        centroids = vectors[rng.choice(n_items, n_lists, replace=False)]
+        for _ in range(n_iter):
+            assignment = np.argmax(vectors @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, vectors)
+            empty = ~sums.any(axis=1)
+            # Re-seed empty clusters so every list stays usable.
+            sums[empty] = vectors[rng.choice(n_items, int(empty.sum()))]
+            centroids = _normalise(sums)
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        list_items = np.argsort(assignment, kind='stable').astype(np.int32)
+        list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        list_offsets[1:] = np.cumsum(np.bincount(assignment, minlength=n_lists))
+        return cls(centroids, list_offsets, list_items, vectors, n_probe)
+
+    def search(self, query, k, n_probe=None, exclude=None):
+        """Find the items most similar to a query vector.
+
+        Parameters
+        ----------
+        query : np.ndarray
+            Query vector in the item factor space.
+        k : int
+            Number of neighbours to return.
+        n_probe : int, optional
+            Clusters to scan; defaults to the index's `n_probe`. More are
+            scanned when these hold fewer than k items.
+        exclude : array-like of int, optional
+            Item positions which may never be returned.
+
+        Returns
+        -------
+        tuple (np.ndarray, np.ndarray)
+            Item positions, best first, and their cosine similarities;
+            fewer than k only when the index holds fewer items.
+
+        """
+        query = _normalise(np.atleast_2d(query))[0]
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        order = top_k(self.centroids @ query, self.n_lists)
+        while True:
+            candidates = np.concatenate(
+                [self.list_items[self.list_offsets[c]:self.list_offsets[c + 1]]
+                 for c in order[:n_probe]])
+            scores = self.vectors[candidates] @ query
+            if exclude is not None and len(exclude):
+                scores[np.isin(candidates, exclude)] = -np.inf
+            if np.isfinite(scores).sum() >= k or n_probe == self.n_lists:
+                break
+            n_probe = min(2 * n_probe, self.n_lists)
+        best = top_k(scores, k)
+        best = best[np.isfinite(scores[best])]
+        return candidates[best], scores[best]
+
+    def save(self, path, stamp=None):
+        """Persist the index to an `.npz` file.
+
+        Parameters
+        ----------
+        path : str
+            Destination file.
+        stamp : np.ndarray, optional
+            Version stamp of the model the index was built from.
+
+        """
+        # Unique per writer, so concurrent rebuilds never share a file.
+        tmp_path = '{}.tmp-{}-{}.npz'.format(path, os.getpid(),
+                                             threading.get_ident())
+        np.savez(tmp_path, centroids=self.centroids,
+                 list_offsets=self.list_offsets, list_items=self.list_items,
+                 vectors=self.vectors, n_probe=self.n_probe,
+                 stamp=np.zeros(0, dtype=np.int64) if stamp is None else stamp)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, stamp=None):
+        """Load a persisted index.
+
+        Parameters
+        ----------
+        path : str
+            Location of the persisted index.
+        stamp : np.ndarray, optional
+            Expected version stamp. `None` is returned if the stored
+            index was built from a different model.
+
+        Returns
+        -------
+        IVFIndex or None
+            The stored index, or `None` when missing or stale.
+
+        """
+        if not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle=False) as stored:
+            if stamp is not None and not np.array_equal(stored['stamp'], stamp):
+                return None
+            return cls(stored['centroids'], stored['list_offsets'],
+                       stored['list_items'], stored['vectors'],
+                       int(stored['n_probe']))
+
+def brute_force_search(vectors, query, k, exclude=None):
+    """Exact cosine similarity search, used as the ANN ground truth.
+
+    Parameters
+    ----------
+    vectors : np.ndarray
+        Unit-length item vectors.
+    query : np.ndarray
+        Query vector.
+    k : int
+        Number of neighbours to return.
+    exclude : array-like of int, optional
+        Item positions which may never be returned.
+
+    Returns
+    -------
+    np.ndarray
+        Positions of the k most similar items, best first.
+
+    """
+    query = _normalise(np.atleast_2d(query))[0]
+    return top_k(vectors @ query, k, exclude=exclude)
+
+def recall_at_k(index, queries, k=10, n_probe=None):
+    """Measure the recall@k of an index against brute-force search.
+
+    Parameters
+    ----------
+    index : IVFIndex
+        Index under test.
+    queries : np.ndarray
+        Query vectors, one per row.
+    k : int
+        Number of neighbours compared per query.
+    n_probe : int, optional
+        Clusters scanned per query; defaults to the index's `n_probe`.
+
+    Returns
+    -------
+    tuple (float, float)
+        Mean recall@k and mean search latency in milliseconds.
+
+    """
+    hits = 0
+    elapsed = 0.0
+    for query in queries:
+        exact = brute_force_search(index.vectors, query, k)
+        start = time.perf_counter()
+        found, _ = index.search(query, k, n_probe=n_probe)
+        elapsed += time.perf_counter() - start
+        hits += len(np.intersect1d(exact, found))
+    return hits / (k * len(queries)), 1000 * elapsed / len(queries)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Report the recall@k of the SVD item factor index.')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--n-probe', type=int, nargs='+', default=[1, 4, 8, 16])
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    from recommenders.collaborative_based import current_model
+    ann_index = current_model().ann_index
+    rng = np.random.default_rng(0)
+    sample = ann_index.vectors[rng.choice(len(ann_index.vectors),
+                                          min(args.queries, len(ann_index.vectors)),
+                                          replace=False)]
+    print(f"{len(ann_index.vectors)} items in {ann_index.n_lists} lists")
+    for n_probe in args.n_probe:
+        recall, latency = recall_at_k(ann_index, sample, args.k, n_probe)
+        print(f"n_probe={n_probe:<4d} recall@{args.k}={recall:.3f} "
+              f"latency={latency:.3f}ms")
@@ -0,0 +1,199 @@
+"""
+
+    Batch (offline) recommendation for many users at once.
+
+    Author: Explore Data Science Academy.
+
+    Description: Reads a file of preference lists, runs them through the
+    shared recommender indexes in vectorised chunks and streams the
+    results to a CSV or JSON-lines file. Only one chunk per worker is
+    held in memory at a time, so arbitrarily large input files can be
+    processed. Chunks can optionally be spread over a process pool.
+
+    Input formats (chosen by file extension):
+
+      - `.jsonl`: one JSON object per line, `{"id": ..., "movies": [...]}`,
+        or a bare JSON list of titles (the line number is used as id).
+      - `.csv`: `id` and `movies` columns, titles separated by '|'.
+
+    Usage:
+
+        python -m recommenders.batch preferences.jsonl recommendations.csv \
+            --algorithm content --top-n 10 --chunk-size 256 --workers 4
+
+"""
+# Script dependencies
+import argparse
+import csv
+import importlib
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+ALGORITHMS = {
+    'content': ('recommenders.content_based', 'batch_content_model'),
+    'collaborative': ('recommenders.collaborative_based', 'batch_collab_model'),
+    'hybrid': ('recommenders.hybrid', 'batch_hybrid_model'),
+}
+
+def read_preferences(path):
+    """Lazily read preference lists from a .jsonl or .csv file.
+
+    Parameters
+    ----------
+    path : str
+        Input file.
+
+    Yields
+    ------
+    tuple (str, list (str))
+        User id and their favourite movies.
+
+    """
+    with open(path, newline='', encoding='utf-8') as source:
+        if path.endswith('.csv'):
+            for row in csv.DictReader(source):
+                movies = [title for title in row['movies'].split('|') if title]
+                yield row['id'], movies
+        else:
+            for number, line in enumerate(source, start=1):
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if isinstance(record, list):
+                    yield str(number), record
+                else:
+                    yield str(record.get('id', number)), record['movies']
+
+def chunked(items, size):
+    """Group an iterable into lists of at most `size` items."""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def recommend_chunk(algorithm, chunk, top_n):
+    """Recommend movies for one chunk of (id, movies) pairs.
+
+    Parameters
+    ----------
+    algorithm : str
+        Key of `ALGORITHMS`.
+    chunk : list (tuple (str, list (str)))
+        User ids and their favourite movies.
+    top_n : int
+        Number of recommendations per user.
+
+    Returns
+    -------
+    list (tuple (str, list (str)))
+        User ids and their recommended titles.
+
+    """
+    module_name, function_name = ALGORITHMS[algorithm]
+    model = getattr(importlib.import_module(module_name), function_name)
+    ids = [user_id for user_id, _ in chunk]
+    return list(zip(ids, model([movies for _, movies in chunk], top_n)))
+
+class ResultWriter:
+    """Stream recommendations to a .csv (id, rank, title) or .jsonl file."""
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'w', newline='', encoding='utf-8')
+        self._csv = None
+        if path.endswith('.csv'):
+            self._csv = csv.writer(self._file)
+            self._csv.writerow(['id', 'rank', 'title'])
+
+    def write(self, results):
+        for user_id, titles in results:
+            if self._csv is not None:
+                self._csv.writerows((user_id, rank, title) for rank, title
+                                    in enumerate(titles, start=1))
+            else:
+                self._file.write(json.dumps({'id': user_id,
+                                             'recommendations': titles}) + '\n')
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def _warm_up(algorithm):
+    """Process pool initializer loading the recommender once per worker."""
+    importlib.import_module(ALGORITHMS[algorithm][0])
+
+def batch_recommend(input_path, output_path, algorithm='content', top_n=10,
+                    chunk_size=256, workers=0):
+    """Recommend movies for every preference list in a file.
+
+    Parameters
+    ----------
+    input_path : str
+        .jsonl or .csv file of preference lists.
+    output_path : str
+        .csv or .jsonl file the recommendations are written to.
+    algorithm : str
+        'content', 'collaborative' or 'hybrid'.
+    top_n : int
+        Number of recommendations per user.
+    chunk_size : int
+        Preference lists scored together in one vectorised step.
+    workers : int
+        Size of the process pool; 0 runs in the current process.
+
+    Returns
+    -------
+    int
+        Number of preference lists processed.
+
+    """
+    count = 0
+    chunks = chunked(read_preferences(input_path), chunk_size)
+    with ResultWriter(output_path) as writer:
+        if workers <= 0:
+            for chunk in chunks:
+                writer.write(recommend_chunk(algorithm, chunk, top_n))
+                count += len(chunk)
+            return count
+        with ProcessPoolExecutor(workers, initializer=_warm_up,
+                                 initargs=(algorithm,)) as executor:
+            # Results are written in input order; at most two chunks per
+            # worker are in flight to keep memory bounded.
+            pending = []
+            for chunk in chunks:
+                pending.append(executor.submit(recommend_chunk, algorithm,
+                                               chunk, top_n))
+                while len(pending) >= 2 * workers:
+                    results = pending.pop(0).result()
+                    writer.write(results)
+                    count += len(results)
+            for future in pending:
+                results = future.result()
+                writer.write(results)
+                count += len(results)
+    return count
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Recommend movies for a file of preference lists.')
+    parser.add_argument('input', help='.jsonl or .csv file of preference lists.')
+    parser.add_argument('output', help='.csv or .jsonl file to write.')
+    parser.add_argument('--algorithm', choices=sorted(ALGORITHMS),
+                        default='content')
+    parser.add_argument('--top-n', type=int, default=10)
+    parser.add_argument('--chunk-size', type=int, default=256)
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Process pool size; 0 runs in-process.')
+    args = parser.parse_args()
+
+    count = batch_recommend(args.input, args.output, args.algorithm,
+                            args.top_n, args.chunk_size, args.workers)
+    print(f"Wrote recommendations for {count} users to {args.output}")
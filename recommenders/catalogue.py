@@ -0,0 +1,122 @@
+"""
+
+    Shared movie catalogue with compact integer ids.
+
+    Author: Explore Data Science Academy.
+
+    Description: Every movie of `movies.csv` gets a dense int32 id, its
+    position in the catalogue. Titles, release years and genre bitmasks
+    are held in contiguous arrays indexed by that id, and titles and
+    MovieLens ids are resolved to ids in O(1) (a title index and a
+    lookup array). The recommenders work on these ids internally and only
+    map back to titles when returning results, so a request does not
+    build per-item Python strings or rescan the movie table.
+
+"""
+# Script dependencies
+import numpy as np
+
+from utils.data_loader import load_movies
+from utils.title_search import TitleIndex
+
+MOVIES_PATH = 'resources/data/movies.csv'
+NO_GENRES = '(no genres listed)'
+
+class Catalogue:
+    """Movies with dense int32 ids.
+
+    Parameters
+    ----------
+    movies : Pandas Dataframe
+        Movies with `movieId`, `title` and `genres` columns, in id order.
+
+    Attributes
+    ----------
+    movie_ids : np.ndarray
+        MovieLens id of each movie (int32).
+    titles : np.ndarray
+        Title of each movie.
+    years : np.ndarray
+        Release year of each movie (int16), 0 when unknown.
+    genre_masks : np.ndarray
+        Bitmask of each movie's genres (uint32); bit `k` stands for
+        `genre_names[k]`.
+    genre_names : list (str)
+        Names of the genre bits.
+
+    """
+    def __init__(self, movies):
+        self.movie_ids = movies['movieId'].to_numpy(dtype=np.int32)
+        self.titles = movies['title'].to_numpy(dtype=object)
+        years = movies['title'].str.extract(r'\((\d{4})\)\s*$', expand=False)
+        self.years = years.fillna(0).astype(np.int16).to_numpy()
+        # Genre lists repeat a lot, so masks are computed per distinct list.
+        genres = movies['genres'].astype('category')
+        lists = [value.split('|') for value in genres.cat.categories]
+        self.genre_names = sorted({genre for genre_list in lists
+                                   for genre in genre_list} - {NO_GENRES})
+        if len(self.genre_names) > 32:
+            raise ValueError('At most 32 genres fit in the genre bitmask')
+        bits = {genre: np.uint32(1 << bit)
+                for bit, genre in enumerate(self.genre_names)}
+        list_masks = np.array([sum(bits.get(genre, 0) for genre in genre_list)
+                               for genre_list in lists] or [0], dtype=np.uint32)
+        self.genre_masks = list_masks[genres.cat.codes.to_numpy()]
+        # MovieLens id -> catalogue id, -1 for unknown ids.
+        self._id_of_movie_id = np.full(int(self.movie_ids.max(initial=0)) + 1,
+                                       -1, dtype=np.int32)
+        self._id_of_movie_id[self.movie_ids[::-1]] = np.arange(
+            len(self.movie_ids), dtype=np.int32)[::-1]
+        self.title_index = TitleIndex(self.titles)
+
+    def __len__(self):
+        return len(self.movie_ids)
+
+    def id_of_title(self, title):
+        """Catalogue id of a title, or None if it is unknown."""
+        return self.title_index.lookup(title)
+
+    def ids_of_titles(self, titles):
+        """Catalogue ids of the known titles among `titles` (int32)."""
+        lookup = self.title_index.lookup
+        return np.array([movie for movie in map(lookup, titles)
+                         if movie is not None], dtype=np.int32)
+
+    def ids_of_movie_ids(self, movie_ids):
+        """Catalogue ids of MovieLens ids (int32), -1 for unknown ids."""
+        movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        known = (movie_ids >= 0) & (movie_ids < len(self._id_of_movie_id))
+        ids = np.full(movie_ids.shape, -1, dtype=np.int32)
+        ids[known] = self._id_of_movie_id[movie_ids[known]]
+        return ids
+
+    def titles_of(self, ids):
+        """Titles of catalogue ids, as a list of str."""
+        return self.titles[np.asarray(ids, dtype=np.intp)].tolist()
+
+    def genres_of(self, movie):
+        """Genre names of one movie."""
+        mask = int(self.genre_masks[movie])
+        return [genre for bit, genre in enumerate(self.genre_names)
+                if mask >> bit & 1]
+
+_catalogues = {}
+
+def get_catalogue(path=MOVIES_PATH):
+    """Return the catalogue of a movies file, loading it once per process.
+
+    Parameters
+    ----------
+    path : str
+        Movie data in .csv format.
+
+    Returns
+    -------
+    Catalogue
+        Catalogue of the movies with complete records.
+
+    """
+    if path not in _catalogues:
+        _catalogues[path] = Catalogue(load_movies(path).dropna()
+                                      .reset_index(drop=True))
+    return _catalogues[path]
@@ -28,49 +28,392 @@
 """
 
 # Script dependencies
-import pandas as pd
+import logging
+import os
+import threading
 import numpy as np
+import scipy.sparse as sp
+# Surprise is only needed to unpickle `SVD.pkl`, which imports it itself.
 import pickle
-import copy
-from surprise import Reader, Dataset
-from surprise import SVD, NormalPredictor, BaselineOnly, KNNBasic, NMF
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import CountVectorizer
+
+from recommenders.ann_index import IVFIndex
+from recommenders.catalogue import get_catalogue
+from recommenders.factors import (bundle_stamp, check_compatibility,
+                                  convert_pickle, current_version,
+                                  from_surprise, is_outdated, is_stale,
+                                  load_factors)
+from recommenders.ranking import top_k
+from recommenders.similar_items import dataset_fingerprint, get_table
+from utils.data_loader import load_ratings
+from utils.tracing import span, traced
+
+logger = logging.getLogger(__name__)
 
 # Importing data
-movies_df = pd.read_csv('resources/data/movies.csv',sep = ',')
-ratings_df = pd.read_csv('resources/data/ratings.csv')
+catalogue = get_catalogue('resources/data/movies.csv')
+ratings_df = load_ratings('resources/data/ratings.csv')
 ratings_df.drop(['timestamp'], axis=1,inplace=True)
 
-# We make use of an SVD model trained on a subset of the MovieLens 10k dataset.
-model=pickle.load(open('resources/models/SVD.pkl', 'rb'))
+# One of 'neighbourhood' (item similarity over the ratings of users
+# predicted to like the chosen movies; the best in offline evaluation),
+# or the faster opt-in modes 'fold_in' (score all movies for a
+# pseudo-user folded into the SVD model from the chosen movies) and
+# 'ann' (nearest neighbours of the chosen movies in the SVD item factor
+# space, read from the precomputed similar-items table when it is up to
+# date).
+COLLAB_MODE = os.environ.get('COLLAB_MODE', 'neighbourhood')
+# Ridge penalty of the pseudo-user's latent vector in 'fold_in' mode,
+# relative to the mean squared norm of the chosen movies' factors.
+FOLD_IN_REG = float(os.environ.get('FOLD_IN_REG', 0.1))
+# Weight of the item biases in 'fold_in' scores. At full weight the
+# same well-rated movies top every list whatever the chosen movies.
+FOLD_IN_BIAS_WEIGHT = float(os.environ.get('FOLD_IN_BIAS_WEIGHT', 0.2))
+MODEL_PATH = 'resources/models/SVD.pkl'
+# Compact factor bundle written by train_colbased.py, or converted from the
+# pickled Surprise model on first load (see `recommenders.factors`).
+FACTORS_PATH = 'resources/models/SVD_factors'
+# Versions published by incremental updates (see recommenders.incremental);
+# the version named in its CURRENT file takes precedence over the above.
+MODEL_VERSIONS_PATH = 'resources/models/SVD_versions'
+ANN_INDEX_PATH = 'resources/models/SVD_ann.npz'
+# Inverted lists scanned per ANN query; higher is slower but more exact.
+ANN_N_PROBE = os.environ.get('ANN_N_PROBE')
+
+def load_model(versions_path=MODEL_VERSIONS_PATH, factors_path=FACTORS_PATH,
+               model_path=MODEL_PATH):
+    """Load the trained SVD model parameters.
+
+    Parameters
+    ----------
+    versions_path : str
+        Folder of published model versions, used when one is current and
+        derives from the current base model.
+    factors_path : str
+        Memory-mappable factor bundle, used when it exists and is not
+        older than the pickled model.
+    model_path : str
+        Pickled Surprise model, converted to a bundle at `factors_path`
+        otherwise.
+
+    Returns
+    -------
+    tuple (FactorModel, str)
+        The model parameters and the path they were loaded from.
+
+    """
+    version = current_version(versions_path)
+    if version is not None:
+        if not is_outdated(version, factors_path, model_path):
+            return checked_model(load_factors(version)), version
+        # Updates published on top of an older base model are dropped;
+        # the next update starts a new line from the current base.
+        logger.warning('Not serving model %s: the base model has changed '
+                       'since it was published', version)
+    if os.path.isdir(factors_path) and not is_stale(factors_path, model_path):
+        model = checked_model(load_factors(factors_path))
+        model.base = bundle_stamp(factors_path)
+        return model, os.path.join(factors_path, 'meta.json')
+    # We make use of an SVD model trained on a subset of the MovieLens 10k
+    # dataset, converted so later starts open it memory-mapped.
+    data = (store_user_ids, store_movie_ids, catalogue.movie_ids)
+    try:
+        model, warnings = convert_pickle(model_path, factors_path, data)
+    except OSError:
+        # Read-only deployment: serve the pickled model from memory.
+        with open(model_path, 'rb') as model_file:
+            return checked_model(from_surprise(pickle.load(model_file))), model_path
+    for warning in warnings:
+        logger.warning('%s: %s', model_path, warning)
+    model.base = bundle_stamp(factors_path)
+    return model, os.path.join(factors_path, 'meta.json')
+
+def checked_model(model):
+    """Check a model against the ratings and movies, logging any warnings.
+
+    Raises
+    ------
+    ValueError
+        If the model was trained for a different dataset.
+
+    """
+    for warning in check_compatibility(model, store_user_ids, store_movie_ids,
+                                       catalogue.movie_ids):
+        logger.warning(warning)
+    return model
+
+def movie_id_of(title):
+    """MovieLens id of a title, or None if it is not in the catalogue."""
+    movie = catalogue.id_of_title(title)
+    return None if movie is None else int(catalogue.movie_ids[movie])
+
+def titles_of(movies, movie_ids):
+    """Titles of catalogue ids, or the MovieLens id where the id is -1.
+
+    Parameters
+    ----------
+    movies : np.ndarray
+        Catalogue ids, -1 for movies missing from the catalogue.
+    movie_ids : np.ndarray
+        MovieLens ids of the same movies.
+
+    Returns
+    -------
+    list (str)
+        Titles of the movies.
+
+    """
+    titles = catalogue.titles_of(np.maximum(movies, 0))
+    return [title if movie >= 0 else str(movie_id) for title, movie, movie_id
+            in zip(titles, movies.tolist(), movie_ids.tolist())]
+
+def inverse_map(movies, size):
+    """Invert an array of catalogue ids, mapping each id to its position."""
+    positions = np.full(size, -1, dtype=np.int32)
+    known = np.flatnonzero(movies >= 0)
+    positions[movies[known]] = known
+    return positions
+
+def build_ratings_store(ratings):
+    """Build a CSR user x item matrix of the MovieLens ratings.
+
+    Parameters
+    ----------
+    ratings : Pandas Dataframe
+        Ratings with `userId`, `movieId` and `rating` columns.
+
+    Returns
+    -------
+    tuple
+        The `scipy.sparse.csr_matrix` of ratings, the MovieLens user id of
+        each row and the MovieLens movie id of each column.
+
+    """
+    store_user_ids, rows = np.unique(ratings['userId'].to_numpy(),
+                                     return_inverse=True)
+    store_movie_ids, cols = np.unique(ratings['movieId'].to_numpy(),
+                                      return_inverse=True)
+    matrix = sp.csr_matrix(
+        (ratings['rating'].to_numpy(dtype=np.float32), (rows, cols)),
+        shape=(len(store_user_ids), len(store_movie_ids)))
+    matrix.sum_duplicates()
+    return matrix, store_user_ids, store_movie_ids
+
+# Ratings are grouped by user once, so any user's row is an O(1) slice.
+ratings_matrix, store_user_ids, store_movie_ids = build_ratings_store(ratings_df)
+user_to_row = {uid: row for row, uid in enumerate(store_user_ids.tolist())}
+# Catalogue id of each ratings column and column of each catalogue id.
+column_movies = catalogue.ids_of_movie_ids(store_movie_ids)
+movie_columns = inverse_map(column_movies, len(catalogue))
+
+def user_ratings(user_id):
+    """Look up the ratings of a single user.
+
+    Parameters
+    ----------
+    user_id : int
+        A MovieLens User ID.
+
+    Returns
+    -------
+    tuple (np.ndarray, np.ndarray)
+        Column positions of the rated movies and the ratings given. Both
+        are views into the ratings store, not copies.
+
+    """
+    row = user_to_row.get(user_id)
+    if row is None:
+        return ratings_matrix.indices[:0], ratings_matrix.data[:0]
+    start, end = ratings_matrix.indptr[row], ratings_matrix.indptr[row + 1]
+    return ratings_matrix.indices[start:end], ratings_matrix.data[start:end]
 
-def prediction_item(item_id):
-    """Map a given favourite movie to users within the
-       MovieLens dataset with the same preference.
+def load_ann_index(vectors, model_path, path=ANN_INDEX_PATH):
+    """Load the ANN index over the item factors, rebuilding it when stale.
+
+    Parameters
+    ----------
+    vectors : np.ndarray
+        Item factors of the model.
+    model_path : str
+        Model the index is derived from. The index is rebuilt whenever
+        this file (or bundle folder) changes.
+    path : str
+        Location of the persisted index, next to the model.
+
+    Returns
+    -------
+    IVFIndex
+        Index over the rows of `vectors`.
+
+    """
+    if os.path.isdir(model_path):
+        model_path = os.path.join(model_path, 'meta.json')
+    stat = os.stat(model_path)
+    stamp = np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+    index = IVFIndex.load(path, stamp=stamp)
+    if index is None:
+        index = IVFIndex.build(vectors)
+        try:
+            index.save(path, stamp=stamp)
+        except OSError:
+            pass
+    if ANN_N_PROBE:
+        index.n_probe = int(ANN_N_PROBE)
+    return index
+
+class ServedModel:
+    """Everything needed to serve recommendations from one model version.
+
+    A served model is built in full, ANN index included, before it is
+    published by `use_model`, and is never modified afterwards. Each
+    request reads one snapshot with `current_model()` and uses it
+    throughout, so a hot reload can never mix the arrays of two versions.
+
+    Parameters
+    ----------
+    model : FactorModel
+        Model parameters.
+    version : str
+        Path the model was loaded from; it identifies the model version.
+    ann_index_path : str
+        Location of the model's persisted ANN index.
+
+    """
+    def __init__(self, model, version, ann_index_path=ANN_INDEX_PATH):
+        self.model = model
+        self.version = version
+        # The fitted parameters are held as arrays so that ratings for every
+        # user can be estimated with a single vectorised operation, i.e.
+        # est = mu + bu + bi[i] + pu @ qi[i].
+        self.global_mean = model.global_mean
+        self.rating_scale = model.rating_scale
+        self.user_factors = model.user_factors
+        self.item_factors = model.item_factors
+        self.user_biases = model.user_biases
+        self.item_biases = model.item_biases
+        # MovieLens ids of the model's rows, and catalogue id <-> inner
+        # (model) id maps of its items (-1 where there is no counterpart).
+        self.item_inner_to_raw = model.item_ids
+        self.user_inner_to_raw = model.user_ids
+        self.item_movies = catalogue.ids_of_movie_ids(self.item_inner_to_raw)
+        self.movie_items = inverse_map(self.item_movies, len(catalogue))
+        self.ann_index = load_ann_index(self.item_factors, version, ann_index_path)
+        self.similarity_fingerprint = dataset_fingerprint(version)
+
+# The served model, replaced as a whole under `_model_lock`.
+served = None
+_model_lock = threading.Lock()
+_reload_thread = None
+# Last published version which failed its compatibility check.
+rejected_version = None
+
+def current_model():
+    """The model currently served, as one consistent snapshot."""
+    return served
+
+def use_model(new_model, source, ann_index_path=ANN_INDEX_PATH):
+    """Make a model the one used to serve recommendations.
+
+    Parameters
+    ----------
+    new_model : FactorModel
+        Model parameters.
+    source : str
+        Path the model was loaded from; it identifies the model version.
+    ann_index_path : str
+        Location of the model's persisted ANN index.
+
+    Returns
+    -------
+    ServedModel
+        The published snapshot.
+
+    """
+    global served
+    state = ServedModel(new_model, source, ann_index_path)
+    with _model_lock:
+        served = state
+    return state
+
+def _reload(version):
+    """Load a published version and serve it, unless it is incompatible."""
+    global rejected_version
+    try:
+        if is_outdated(version, FACTORS_PATH, MODEL_PATH):
+            raise ValueError('the base model has changed since it was published')
+        new_model = checked_model(load_factors(version))
+    except OSError:
+        # The version was replaced while being opened; retry next time.
+        return
+    except ValueError as error:
+        logger.error('Not serving model %s: %s', version, error)
+        rejected_version = version
+        return
+    use_model(new_model, version)
+
+@traced()
+def refresh_model(wait=False):
+    """Hot-reload the model if a new version has been published.
+
+    The new version is loaded, and its ANN index built, in a background
+    thread; requests keep being served by the current model until it
+    is published.
+
+    Parameters
+    ----------
+    wait : bool
+        Block until the new version is served (or rejected).
+
+    Returns
+    -------
+    bool
+        Whether a new model version started loading.
+
+    """
+    global _reload_thread
+    version = current_version(MODEL_VERSIONS_PATH)
+    if version is None or version in (served.version, rejected_version):
+        return False
+    with _model_lock:
+        started = _reload_thread is None or not _reload_thread.is_alive()
+        if started:
+            _reload_thread = threading.Thread(target=_reload, args=(version,),
+                                              name='model-reload', daemon=True)
+            _reload_thread.start()
+        thread = _reload_thread
+    if wait:
+        thread.join()
+    return started
+
+use_model(*load_model())
+
+@traced()
+def prediction_item(item_id, state=None):
+    """Estimate the rating every user within the MovieLens dataset
+       would give to a movie.
 
     Parameters
     ----------
     item_id : int
         A MovieLens Movie ID.
+    state : ServedModel, optional
+        Model snapshot to use; defaults to the current one.
 
     Returns
     -------
-    list
-        User IDs of users with similar high ratings for the given movie.
+    np.ndarray
+        Estimated ratings, indexed by the model's inner user id.
 
     """
-    # Data preprosessing
-    reader = Reader(rating_scale=(0, 5))
-    load_df = Dataset.load_from_df(ratings_df,reader)
-    a_train = load_df.build_full_trainset()
-
-    predictions = []
-    for ui in a_train.all_users():
-        predictions.append(model.predict(iid=item_id,uid=ui, verbose = False))
-    return predictions
+    state = state or current_model()
+    inner_iid = state.model.item_index.get(item_id)
+    estimates = state.global_mean + state.user_biases
+    if inner_iid is not None:
+        estimates = (estimates + state.item_biases[inner_iid]
+                     + state.user_factors @ state.item_factors[inner_iid])
+    return np.clip(estimates, *state.rating_scale)
 
-def pred_movies(movie_list):
+@traced()
+def pred_movies(movie_list, state=None):
     """Maps the given favourite movies selected within the app to corresponding
     users within the MovieLens dataset.
 
@@ -78,6 +421,8 @@ def pred_movies(movie_list):
     ----------
     movie_list : list
         Three favourite movies selected by the app user.
+    state : ServedModel, optional
+        Model snapshot to use; defaults to the current one.
 
     Returns
     -------
@@ -85,22 +430,243 @@ def pred_movies(movie_list):
         User-ID's of users with similar high ratings for each movie.
 
     """
+    if state is None:
+        refresh_model()
+        state = current_model()
     # Store the id of users
     id_store=[]
     # For each movie selected by a user of the app,
     # predict a corresponding user within the dataset with the highest rating
     for i in movie_list:
-        predictions = prediction_item(item_id = i)
-        predictions.sort(key=lambda x: x.est, reverse=True)
+        movie_id = movie_id_of(i)
+        predictions = prediction_item(i if movie_id is None else movie_id, state)
         # Take the top 10 user id's from each movie with highest rankings
-        for pred in predictions[:10]:
-            id_store.append(pred.uid)
+        id_store.extend(state.user_inner_to_raw[top_k(predictions, 10)].tolist())
     # Return a list of user id's
     return id_store
 
+def chosen_items(movie_list, state):
+    """Map chosen titles onto the model's inner item ids.
+
+    Parameters
+    ----------
+    movie_list : list (str)
+        Favorite movies chosen by the app user.
+    state : ServedModel
+        Model snapshot to use.
+
+    Returns
+    -------
+    list (int)
+        Inner ids of the chosen movies known to the model.
+
+    """
+    items = state.movie_items[catalogue.ids_of_titles(movie_list)]
+    return items[items >= 0].tolist()
+
+def fold_in_user(items, state, ratings=None, reg=None):
+    """Solve for the latent vector of a new user in closed form.
+
+    The chosen movies are treated as ratings by a pseudo-user, and its
+    factors p are the ridge regression of the rating residuals on the
+    movies' factors Q, i.e. p = Q^T (Q Q^T + lambda I)^-1 (r - mu - bi),
+    where lambda is `reg` times the mean of trace(Q Q^T) over the chosen
+    movies, so the shrinkage does not depend on the scale of the factors.
+    The system solved is only as large as the number of chosen movies.
+
+    Parameters
+    ----------
+    items : list (int)
+        Inner ids of the movies rated by the pseudo-user.
+    state : ServedModel
+        Model snapshot to use.
+    ratings : array-like, optional
+        Ratings given; the movies are treated as top-rated if omitted.
+    reg : float, optional
+        Relative ridge penalty; defaults to `FOLD_IN_REG`.
+
+    Returns
+    -------
+    np.ndarray
+        Latent vector of the pseudo-user.
+
+    """
+    reg = FOLD_IN_REG if reg is None else reg
+    if ratings is None:
+        ratings = np.full(len(items), state.rating_scale[1])
+    factors = np.asarray(state.item_factors[items], dtype=np.float64)
+    residuals = (np.asarray(ratings, dtype=np.float64) - state.global_mean
+                 - state.item_biases[items])
+    gram = factors @ factors.T
+    gram += reg * np.trace(gram) / len(items) * np.eye(len(items))
+    return factors.T @ np.linalg.solve(gram, residuals)
+
+def fold_in_scores(users, state, items=slice(None)):
+    """Score movies for one or more folded-in users.
+
+    The user bias and global mean are the same for every movie and do
+    not change the ranking, so they are left out, and the item biases
+    are weighted by `FOLD_IN_BIAS_WEIGHT`.
+
+    Parameters
+    ----------
+    users : np.ndarray
+        Latent vector of a user, or one vector per row.
+    state : ServedModel
+        Model snapshot to use.
+    items : array-like, optional
+        Inner ids of the movies to score; all movies if omitted.
+
+    Returns
+    -------
+    np.ndarray
+        Score of every movie, with one row per user if `users` is 2-D.
+
+    """
+    factors = np.asarray(state.item_factors[items])
+    return FOLD_IN_BIAS_WEIGHT * state.item_biases[items] + users @ factors.T
+
+def fold_in_collab_model(movie_list, top_n=10, state=None):
+    """Recommend the movies a pseudo-user who loves the chosen movies
+       would rate highest.
+
+    Parameters
+    ----------
+    movie_list : list (str)
+        Favorite movies chosen by the app user.
+    top_n : int
+        Number of top recommendations to return to the user.
+    state : ServedModel, optional
+        Model snapshot to use; defaults to the current one.
+
+    Returns
+    -------
+    list (str) or None
+        Titles of the top-n movie recommendations, or None when none of
+        the chosen movies is known to the model.
+
+    """
+    state = state or current_model()
+    chosen = chosen_items(movie_list, state)
+    if not chosen:
+        return None
+    scores = fold_in_scores(fold_in_user(chosen, state), state)
+    top_indexes = top_k(scores, top_n, exclude=chosen)
+    return titles_of(state.item_movies[top_indexes],
+                     state.item_inner_to_raw[top_indexes])
+
+def batch_collab_model(movie_lists, top_n=10):
+    """Performs Collaborative filtering for many lists of movies at once.
+
+    In 'fold_in' mode the pseudo-users of the whole batch are scored
+    against all movies with a single matrix product; other modes fall
+    back to one `collab_model` call per list.
+
+    Parameters
+    ----------
+    movie_lists : list (list (str))
+        Favorite movies of each user, of any length.
+    top_n : int
+        Number of top recommendations to return to each user.
+
+    Returns
+    -------
+    list (list (str))
+        Titles of the top-n movie recommendations to each user.
+
+    """
+    refresh_model()
+    state = current_model()
+    if COLLAB_MODE != 'fold_in':
+        return [_collab_model(movie_list, top_n, state)
+                for movie_list in movie_lists]
+    chosen = [chosen_items(movie_list, state) for movie_list in movie_lists]
+    known = [position for position, items in enumerate(chosen) if items]
+    recommended_movies = [None] * len(movie_lists)
+    if known:
+        users = np.stack([fold_in_user(chosen[position], state)
+                          for position in known])
+        scores = fold_in_scores(users, state)
+        for user_scores, position in zip(scores, known):
+            top_indexes = top_k(user_scores, top_n, exclude=chosen[position])
+            recommended_movies[position] = titles_of(
+                state.item_movies[top_indexes],
+                state.item_inner_to_raw[top_indexes])
+    for position, movie_list in enumerate(movie_lists):
+        if recommended_movies[position] is None:
+            recommended_movies[position] = _collab_model(movie_list, top_n,
+                                                         state)
+    return recommended_movies
+
+def ann_collab_model(movie_list, top_n=10, state=None):
+    """Recommend the movies closest to the chosen ones in the SVD item
+       factor space.
+
+    The nearest neighbours of each chosen movie are merged, ranking each
+    movie by its highest similarity to any chosen one. They are read from
+    the similar-items table when it is up to date and deep enough, and
+    searched in the ANN index otherwise.
+
+    Parameters
+    ----------
+    movie_list : list (str)
+        Favorite movies chosen by the app user.
+    top_n : int
+        Number of top recommendations to return to the user.
+    state : ServedModel, optional
+        Model snapshot to use; defaults to the current one.
+
+    Returns
+    -------
+    list (str) or None
+        Titles of the top-n movie recommendations, or None when none of
+        the chosen movies is known to the model.
+
+    """
+    state = state or current_model()
+    chosen = chosen_items(movie_list, state)
+    if not chosen:
+        return None
+    table = get_table('collaborative', state.similarity_fingerprint)
+    found = table.recommend(chosen, top_n) if table is not None else None
+    if found is None:
+        found = ann_neighbours(chosen, top_n, state)
+    return titles_of(state.item_movies[found], state.item_inner_to_raw[found])
+
+def ann_neighbours(items, top_n, state):
+    """Merge the ANN neighbours of several movies, as
+       `SimilarItemsTable.recommend` merges their table rows.
+
+    Parameters
+    ----------
+    items : list (int)
+        Inner ids of the chosen movies.
+    top_n : int
+        Number of movies to return.
+    state : ServedModel
+        Model snapshot to use.
+
+    Returns
+    -------
+    list (int)
+        Inner ids of the top-n movies by their highest similarity to any
+        of `items`, which are excluded.
+
+    """
+    ann_index = state.ann_index
+    best = {}
+    for item in items:
+        found, scores = ann_index.search(ann_index.vectors[item], top_n,
+                                         exclude=items)
+        for neighbour, score in zip(found.tolist(), scores.tolist()):
+            if score > best.get(neighbour, -np.inf):
+                best[neighbour] = score
+    return sorted(best, key=lambda neighbour: (-best[neighbour], neighbour))[:top_n]
+
 # !! DO NOT CHANGE THIS FUNCTION SIGNATURE !!
 # You are, however, encouraged to change its content.  
 
+@traced()
 def collab_model(movie_list,top_n=10):
     """Performs Collaborative filtering based upon a list of movies supplied
        by the app user.
@@ -118,34 +684,51 @@ def collab_model(movie_list,top_n=10):
         Titles of the top-n movie recommendations to the user.
 
     """
+    refresh_model()
+    return _collab_model(movie_list, top_n, current_model())
+
+def _collab_model(movie_list, top_n, state):
+    """`collab_model` on one model snapshot."""
+    if COLLAB_MODE == 'fold_in':
+        with span('collab.fold_in'):
+            recommended_movies = fold_in_collab_model(movie_list, top_n, state)
+        if recommended_movies is not None:
+            return recommended_movies
+    if COLLAB_MODE == 'ann':
+        with span('collab.ann'):
+            recommended_movies = ann_collab_model(movie_list, top_n, state)
+        if recommended_movies is not None:
+            return recommended_movies
 
-    indices = pd.Series(movies_df['title'])
-    movie_ids = pred_movies(movie_list)
-    df_init_users = pd.DataFrame(columns=ratings_df.columns)
-    for i in movie_ids:
-        user_ratings_df = ratings_df[ratings_df['userId'] == i]
-        df_init_users = pd.concat([df_init_users, user_ratings_df], ignore_index=True)
-        
-    # Getting the cosine similarity matrix
-    cosine_sim = cosine_similarity(np.array(df_init_users), np.array(df_init_users))
-    idx_1 = indices[indices == movie_list[0]].index[0]
-    idx_2 = indices[indices == movie_list[1]].index[0]
-    idx_3 = indices[indices == movie_list[2]].index[0]
-    # Creating a Series with the similarity scores in descending order
-    rank_1 = cosine_sim[idx_1]
-    rank_2 = cosine_sim[idx_2]
-    rank_3 = cosine_sim[idx_3]
-    # Calculating the scores
-    score_series_1 = pd.Series(rank_1).sort_values(ascending = False)
-    score_series_2 = pd.Series(rank_2).sort_values(ascending = False)
-    score_series_3 = pd.Series(rank_3).sort_values(ascending = False)
-     # Appending the names of movies
-    listings = pd.concat([score_series_1, score_series_2, score_series_3]).sort_values(ascending=False)
-    recommended_movies = []
-    # Choose top 50
-    top_50_indexes = list(listings.iloc[1:50].index)
-    # Removing chosen movies
-    top_indexes = np.setdiff1d(top_50_indexes,[idx_1,idx_2,idx_3])
-    for i in top_indexes[:top_n]:
-        recommended_movies.append(list(movies_df['title'])[i])
-    return recommended_movies
\ No newline at end of file
+    # Users in the dataset who would rate the chosen movies highly
+    neighbours = list(dict.fromkeys(pred_movies(movie_list, state)))
+    if not neighbours:
+        return []
+    with span('collab.neighbour_ratings', neighbours=len(neighbours)):
+        # Stack the neighbours' rating rows into a sparse neighbour x item block
+        row_slices = [user_ratings(uid) for uid in neighbours]
+        indptr = np.zeros(len(row_slices) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(cols) for cols, _ in row_slices])
+        block = sp.csr_matrix(
+            (np.concatenate([vals for _, vals in row_slices]),
+             np.concatenate([cols for cols, _ in row_slices]), indptr),
+            shape=(len(row_slices), ratings_matrix.shape[1]))
+    with span('collab.item_similarity'):
+        # Item-item cosine similarity over the neighbours' ratings; only the
+        # columns of the chosen movies are compared against the catalogue.
+        block = block.tocsc()
+        norms = np.sqrt(np.asarray(block.multiply(block).sum(axis=0))).ravel()
+        norms[norms == 0] = 1.0
+        block = block @ sp.diags(1.0 / norms)
+        chosen = movie_columns[catalogue.ids_of_titles(movie_list)]
+        chosen = chosen[chosen >= 0].tolist()
+        if chosen:
+            similarity = (block[:, chosen].T @ block).toarray()
+            scores = similarity.max(axis=0)
+        else:
+            # None of the chosen movies has been rated; fall back to what the
+            # neighbours rated most highly.
+            scores = np.asarray(block.sum(axis=0)).ravel()
+    with span('collab.rank'):
+        top_indexes = top_k(scores, top_n, exclude=chosen)
+    return titles_of(column_movies[top_indexes], store_movie_ids[top_indexes])
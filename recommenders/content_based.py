@@ -28,39 +28,344 @@
 """
 
 # Script dependencies
+import hashlib
+import json
 import os
+import threading
+import zipfile
 import pandas as pd
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import CountVectorizer
+import scipy.sparse as sp
 
-# Importing data
-movies = pd.read_csv('resources/data/movies.csv', sep = ',')
-ratings = pd.read_csv('resources/data/ratings.csv')
-movies.dropna(inplace=True)
+from recommenders.catalogue import get_catalogue
+from recommenders.ranking import top_k
+from recommenders.similar_items import dataset_fingerprint, get_table
+from utils.data_loader import load_movies
+from utils.tracing import span, traced
 
-def data_preprocessing(subset_size):
+MOVIES_PATH = 'resources/data/movies.csv'
+# Optional sources of extra movie features; used when present.
+TAGS_PATH = 'resources/data/tags.csv'
+IMDB_PATH = 'resources/data/imdb_data.csv'
+CONTENT_INDEX_PATH = 'resources/models/content_index.npz'
+# Bump when the features change, so persisted indexes are rebuilt.
+CONTENT_FEATURES_VERSION = 3
+# Features are hashed into a fixed number of columns, so the index size
+# does not grow with the vocabulary of tags and names.
+FEATURE_DIM = 2 ** 18
+# Relative weight of each field's features in a movie's vector.
+FIELD_WEIGHTS = {'genres': 1.0, 'year': 0.1, 'tags': 0.5, 'cast': 0.5,
+                 'director': 0.5}
+# Fields kept at their fixed weight rather than weighted by IDF. Release
+# dates are rare tokens, so with IDF they outweighed every genre; only
+# the decade is used, at a low weight, to break ties between movies of
+# the same genres.
+FIXED_WEIGHT_FIELDS = ('year',)
+
+# Rows of the content index are the movies' catalogue ids.
+catalogue = get_catalogue(MOVIES_PATH)
+
+class ContentIndex:
+    """L2-normalised sparse TF-IDF matrix of movie features.
+
+    Each row of `matrix` is the feature vector of one movie, scaled to
+    unit length, so the dot product of two rows is their cosine
+    similarity. `titles` holds the title of each row.
+
+    """
+    def __init__(self, matrix, titles):
+        self.matrix = matrix.tocsr()
+        self.titles = np.asarray(titles)
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+def _tokens(values, field):
+    """Turn '|'-separated names into field-prefixed tokens."""
+    return values.fillna('').str.lower().str.replace(' ', '_', regex=False) \
+        .str.split('|').map(lambda names: ' '.join(
+            f'{field}={name}' for name in names if name))
+
+def _movie_field(path, column, field, movie_ids, chunk_size=1000000):
+    """Tokens of one field of an optional per-movie data file.
+
+    Parameters
+    ----------
+    path : str
+        .csv file with a `movieId` column; rows of the same movie are
+        combined. Missing files yield no tokens.
+    column : str
+        Column holding '|'-separated names.
+    field : str
+        Prefix of the tokens.
+    movie_ids : Pandas Series
+        Movies to return tokens for.
+
+    Returns
+    -------
+    Pandas Series
+        Space-separated tokens of each movie, aligned with `movie_ids`.
+
+    """
+    if not os.path.exists(path):
+        return pd.Series('', index=movie_ids.index)
+    parts = []
+    for chunk in pd.read_csv(path, usecols=['movieId', column],
+                             chunksize=chunk_size):
+        chunk = chunk.dropna()
+        parts.append(pd.Series(_tokens(chunk[column].astype(str), field).values,
+                               index=chunk['movieId'].values))
+    if not parts:
+        return pd.Series('', index=movie_ids.index)
+    tokens = pd.concat(parts)
+    tokens = tokens[tokens != ''].groupby(level=0).agg(' '.join)
+    return movie_ids.map(tokens).fillna('')
+
+def data_preprocessing(subset_size=None):
     """Prepare data for use within Content filtering algorithm.
 
+    Every feature field becomes a column of space-separated tokens:
+    genres, release decade, and, when their files exist, user
+    tags (`tags.csv`) and cast and director (`imdb_data.csv`).
+
     Parameters
     ----------
-    subset_size : int
-        Number of movies to use within the algorithm.
+    subset_size : int, optional
+        Number of movies to use within the algorithm. The full catalogue
+        is used when omitted.
 
     Returns
     -------
     Pandas Dataframe
-        Subset of movies selected for content-based filtering.
+        Subset of movies selected for content-based filtering, with one
+        column per key of `FIELD_WEIGHTS`.
+
+    """
+    # Importing data
+    movies = load_movies(MOVIES_PATH).dropna()
+    data = movies[['movieId', 'title']][:subset_size].copy()
+    genres = movies['genres'][:subset_size].astype(str) \
+        .str.replace('(no genres listed)', '', regex=False)
+    data['genres'] = _tokens(genres, 'genre')
+    years = data['title'].str.extract(r'\((\d{4})\)\s*$', expand=False)
+    data['year'] = ('decade=' + years.str[:3] + '0').fillna('')
+    data['tags'] = _movie_field(TAGS_PATH, 'tag', 'tag', data['movieId'])
+    data['cast'] = _movie_field(IMDB_PATH, 'title_cast', 'cast', data['movieId'])
+    data['director'] = _movie_field(IMDB_PATH, 'director', 'director',
+                                    data['movieId'])
+    return data
+
+def _source_stamp(path):
+    """Identify a version of a source file by its size and mtime."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return [-1, -1]
+    return [stat.st_size, stat.st_mtime_ns]
+
+def features_digest():
+    """Hex digest of the feature configuration, including its weights."""
+    config = [CONTENT_FEATURES_VERSION, FEATURE_DIM, FIELD_WEIGHTS,
+              FIXED_WEIGHT_FIELDS]
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+def content_sources():
+    """Stamp of the feature configuration and every feature source."""
+    stamp = [CONTENT_FEATURES_VERSION, FEATURE_DIM,
+             int(features_digest()[:15], 16)]
+    for path in (MOVIES_PATH, TAGS_PATH, IMDB_PATH):
+        stamp.extend(_source_stamp(path))
+    return np.array(stamp, dtype=np.int64)
+
+def build_content_index(data, chunk_size=10000):
+    """Build the content index for a set of movies.
+
+    The hashed term counts are computed chunk by chunk, together with
+    the document frequency of every feature, and turned into sublinear
+    TF-IDF weights at the end. The fields of `FIXED_WEIGHT_FIELDS` are
+    added after the IDF weighting, at their weight alone. Nothing dense
+    is ever materialised.
+
+    Parameters
+    ----------
+    data : Pandas Dataframe
+        Movies with a `title` column and a token column per field of
+        `FIELD_WEIGHTS`, as returned by `data_preprocessing`.
+    chunk_size : int
+        Number of movies vectorised at a time.
+
+    Returns
+    -------
+    ContentIndex
+        Normalised feature matrix for `data`.
+
+    """
+    # scikit-learn is only imported when an index has to be built.
+    from sklearn.feature_extraction.text import HashingVectorizer
+    from sklearn.preprocessing import normalize
+
+    vectorizer = HashingVectorizer(n_features=FEATURE_DIM, token_pattern=r'\S+',
+                                   lowercase=False, norm=None,
+                                   alternate_sign=False, dtype=np.float32)
+    chunks = {True: [], False: []}
+    document_frequency = np.zeros(FEATURE_DIM, dtype=np.int64)
+    for start in range(0, len(data), chunk_size):
+        chunk = data.iloc[start:start + chunk_size]
+        counts = {fixed: sp.csr_matrix((len(chunk), FEATURE_DIM),
+                                       dtype=np.float32)
+                  for fixed in (True, False)}
+        for field, weight in FIELD_WEIGHTS.items():
+            field_counts = vectorizer.transform(chunk[field])
+            # Sublinear term frequency: a tag applied by many users
+            # should not drown out the other features.
+            field_counts.data = weight * (1 + np.log(field_counts.data))
+            fixed = field in FIXED_WEIGHT_FIELDS
+            counts[fixed] = counts[fixed] + field_counts
+        counts[False].sum_duplicates()
+        document_frequency += np.bincount(counts[False].indices,
+                                          minlength=FEATURE_DIM)
+        for fixed in (True, False):
+            chunks[fixed].append(counts[fixed])
+    matrices = {fixed: sp.vstack(parts, format='csr') if parts else
+                sp.csr_matrix((0, FEATURE_DIM), dtype=np.float32)
+                for fixed, parts in chunks.items()}
+    idf = np.log((1 + len(data)) / (1 + document_frequency)) + 1
+    matrix = matrices[False]
+    matrix.data *= idf[matrix.indices].astype(np.float32)
+    matrix = normalize(matrix + matrices[True], norm='l2', copy=False)
+    return ContentIndex(matrix, data['title'].to_numpy(dtype=str))
+
+def save_content_index(index, path, stamp):
+    """Persist a content index to a compressed `.npz` file.
+
+    Parameters
+    ----------
+    index : ContentIndex
+        Index to store.
+    path : str
+        Destination file.
+    stamp : np.ndarray
+        Version stamp of the data the index was built from.
+
+    """
+    matrix = index.matrix
+    # Each writer stages its own file, so concurrent rebuilds never mix
+    # their archives.
+    tmp_path = '{}.tmp-{}-{}.npz'.format(path, os.getpid(),
+                                         threading.get_ident())
+    np.savez_compressed(tmp_path, data=matrix.data, indices=matrix.indices,
+                        indptr=matrix.indptr, shape=np.array(matrix.shape),
+                        titles=index.titles, stamp=stamp)
+    os.replace(tmp_path, path)
+
+def load_content_index(path=CONTENT_INDEX_PATH):
+    """Load the persisted content index, rebuilding it when stale.
+
+    Parameters
+    ----------
+    path : str
+        Location of the persisted index. The index is rebuilt whenever
+        one of its sources or the feature configuration changes, or when
+        the file cannot be read.
+
+    Returns
+    -------
+    ContentIndex
+        Index covering the full movie catalogue.
+
+    """
+    stamp = content_sources()
+    if os.path.exists(path):
+        try:
+            with np.load(path, allow_pickle=False) as stored:
+                if np.array_equal(stored['stamp'], stamp):
+                    matrix = sp.csr_matrix(
+                        (stored['data'], stored['indices'], stored['indptr']),
+                        shape=tuple(stored['shape']))
+                    return ContentIndex(matrix, stored['titles'])
+        except (ValueError, KeyError, OSError, zipfile.BadZipFile):
+            # A truncated or corrupt file is rebuilt like a stale one.
+            pass
+    index = build_content_index(data_preprocessing())
+    try:
+        save_content_index(index, path, stamp)
+    except OSError:
+        # A read-only deployment can still serve from the in-memory index.
+        pass
+    return index
+
+content_index = load_content_index()
+# Identifies the data of the precomputed similar-items table.
+similarity_fingerprint = '{}-{}'.format(
+    dataset_fingerprint(*(path for path in (MOVIES_PATH, TAGS_PATH, IMDB_PATH)
+                          if os.path.exists(path))),
+    features_digest())
+
+def batch_content_model(movie_lists, top_n=10):
+    """Performs Content filtering for many lists of movies at once.
+
+    Lists are answered from the precomputed similar-items table when it
+    is up to date. For the others, the similarity columns of all chosen
+    movies are computed with a single sparse product against the content
+    index.
+
+    Parameters
+    ----------
+    movie_lists : list (list (str))
+        Favorite movies of each user, of any length. Titles missing from
+        the catalogue are ignored.
+    top_n : int
+        Number of top recommendations to return to each user.
+
+    Returns
+    -------
+    list (list (str))
+        Titles of the top-n movie recommendations to each user; empty
+        when none of a user's movies is in the catalogue.
 
     """
-    # Split genre data into individual words.
-    movies['keyWords'] = movies['genres'].str.replace('|', ' ')
-    # Subset of the data
-    movies_subset = movies[:subset_size]
-    return movies_subset
+    # Getting the rows of the chosen movies
+    rows = [catalogue.ids_of_titles(movie_list).tolist()
+            for movie_list in movie_lists]
+    recommended_movies = [[] for _ in movie_lists]
+    # Lists are answered from the precomputed top-K table when it is up
+    # to date and deep enough; the rest are scored below.
+    table = get_table('content', similarity_fingerprint)
+    pending = []
+    with span('content.similar_items_table', found=table is not None):
+        for position, user_rows in enumerate(rows):
+            if not user_rows:
+                continue
+            found = table.recommend(user_rows, top_n) if table is not None else None
+            if found is None:
+                pending.append(position)
+            else:
+                recommended_movies[position] = catalogue.titles_of(found)
+    if not pending:
+        return recommended_movies
+    # Cosine similarity of every movie to the chosen ones; only these
+    # rows of the similarity matrix are ever computed, and only over the
+    # features the chosen movies actually have.
+    with span('content.similarity', lists=len(pending)):
+        query = content_index.matrix[[row for position in pending
+                                      for row in rows[position]]]
+        features = np.unique(query.indices)
+        similarity = np.ascontiguousarray(
+            query[:, features].toarray() @ content_index.matrix[:, features].T)
+    with span('content.rank'):
+        offset = 0
+        for position in pending:
+            user_rows = rows[position]
+            # Score each movie by its best match among the chosen movies
+            scores = similarity[offset:offset + len(user_rows)].max(axis=0)
+            offset += len(user_rows)
+            top_indexes = top_k(scores, top_n, exclude=user_rows)
+            recommended_movies[position] = catalogue.titles_of(top_indexes)
+    return recommended_movies
 
 # !! DO NOT CHANGE THIS FUNCTION SIGNATURE !!
 # You are, however, encouraged to change its content.  
+@traced()
 def content_model(movie_list,top_n=10):
     """Performs Content filtering based upon a list of movies supplied
        by the app user.
@@ -78,35 +383,4 @@ def content_model(movie_list,top_n=10):
         Titles of the top-n movie recommendations to the user.
 
     """
-    # Initializing the empty list of recommended movies
-    recommended_movies = []
-    data = data_preprocessing(10000)
-    # Instantiating and generating the count matrix
-    count_vec = CountVectorizer()
-    count_matrix = count_vec.fit_transform(data['keyWords'])
-    indices = pd.Series(data['title'])
-    cosine_sim = cosine_similarity(count_matrix, count_matrix)
-    # Getting the index of the movie that matches the title
-    idx_1 = indices[indices == movie_list[0]].index[0]
-    idx_2 = indices[indices == movie_list[1]].index[0]
-    idx_3 = indices[indices == movie_list[2]].index[0]
-    # Creating a Series with the similarity scores in descending order
-    rank_1 = cosine_sim[idx_1]
-    rank_2 = cosine_sim[idx_2]
-    rank_3 = cosine_sim[idx_3]
-    # Calculating the scores
-    score_series_1 = pd.Series(rank_1).sort_values(ascending = False)
-    score_series_2 = pd.Series(rank_2).sort_values(ascending = False)
-    score_series_3 = pd.Series(rank_3).sort_values(ascending = False)
-    # Getting the indexes of the 10 most similar movies
-    listings = pd.concat([score_series_1, score_series_2, score_series_3]).sort_values(ascending=False)
-
-    # Store movie names
-    recommended_movies = []
-    # Appending the names of movies
-    top_50_indexes = list(listings.iloc[1:50].index)
-    # Removing chosen movies
-    top_indexes = np.setdiff1d(top_50_indexes,[idx_1,idx_2,idx_3])
-    for i in top_indexes[:top_n]:
-        recommended_movies.append(list(movies['title'])[i])
-    return recommended_movies
\ No newline at end of file
+    return batch_content_model([movie_list], top_n)[0]
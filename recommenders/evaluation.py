@@ -0,0 +1,495 @@
+"""
+
+    Offline evaluation of the recommenders.
+
+    Author: Explore Data Science Academy.
+
+    Description: Measures recommendation quality against its cost. The
+    ratings are split into folds, either by time (rolling origin: each
+    fold trains on the ratings before a cutoff and tests on the next
+    slice of time) or by leaving k random ratings of every user out.
+    For each test user the app's query is replayed: their most recent
+    well-rated training movies are passed to a recommender, and its
+    recommendations are scored against the movies they rated well in the
+    test slice with precision@k, recall@k and NDCG@k, plus the catalogue
+    coverage of all recommendations and the share of lists holding the
+    most recommended movie, which flags recommenders whose lists barely
+    change with the query. The latency of every query is
+    recorded next to the metrics, so speed/quality settings (the
+    collaborative mode, ANN `n_probe`, the number of SVD factors) can be
+    compared with data.
+
+    The queries of a fold are written once as `.npy` arrays, and users
+    are evaluated in parallel by a process pool whose workers open them
+    memory-mapped, so the split is never pickled per task.
+
+    The served SVD model was trained on all ratings, so unless
+    `--retrain-factors` is given (fitting ALS factors on each fold's
+    training ratings) collaborative and hybrid scores are optimistic.
+    The ratings store of the neighbourhood mode and the hybrid
+    popularity penalty always cover all ratings.
+
+    Usage:
+
+        python -m recommenders.evaluation --algorithm content collaborative \
+            --split time --folds 3 --k 10 --workers 4 --output results.json
+        python -m recommenders.evaluation --algorithm collaborative \
+            --collab-mode ann --n-probe 4 --retrain-factors 50
+
+"""
+# Script dependencies
+import argparse
+import importlib
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from recommenders.catalogue import MOVIES_PATH, get_catalogue
+from recommenders.factors import load_factors
+from utils.data_loader import load_ratings
+
+RATINGS_PATH = 'resources/data/ratings.csv'
+TRAINER_PATH = 'resources/models/train_colbased.py'
+ALGORITHMS = {
+    'content': ('recommenders.content_based', 'content_model'),
+    'collaborative': ('recommenders.collaborative_based', 'collab_model'),
+    'hybrid': ('recommenders.hybrid', 'hybrid_model'),
+}
+# Arrays describing the queries of a fold, stored as CSR-style offsets
+# into flat arrays of catalogue ids.
+QUERY_ARRAYS = ('user_ids', 'query_offsets', 'query_movies',
+                'relevant_offsets', 'relevant_movies')
+# Share of lists holding the same movie above which a recommender is
+# reported as ignoring its query.
+TOP_SHARE_LIMIT = 0.5
+
+def time_split(timestamps, n_folds, test_fraction):
+    """Rolling-origin splits of ratings by time.
+
+    Fold `f` tests on the ratings between the quantiles
+    `1 - (n_folds - f) * test_fraction` and `1 - (n_folds - f - 1) * test_fraction`
+    of the timestamps, and trains on everything before.
+
+    Parameters
+    ----------
+    timestamps : np.ndarray
+        Timestamp of each rating.
+    n_folds : int
+        Number of folds.
+    test_fraction : float
+        Share of the ratings tested on in each fold.
+
+    Yields
+    ------
+    tuple (np.ndarray, np.ndarray)
+        Boolean train and test masks over the ratings.
+
+    """
+    if n_folds * test_fraction >= 1:
+        raise ValueError('n_folds * test_fraction must be below 1')
+    for fold in range(n_folds):
+        start = np.quantile(timestamps, 1 - (n_folds - fold) * test_fraction)
+        end = np.quantile(timestamps, 1 - (n_folds - fold - 1) * test_fraction)
+        train = timestamps < start
+        test = ~train & ((timestamps < end) if fold < n_folds - 1 else True)
+        yield train, test
+
+def leave_k_out_split(user_ids, n_folds, k, seed=0):
+    """Hold out k random ratings of every user, once per fold.
+
+    Users with k ratings or fewer are kept in the training set only.
+
+    Parameters
+    ----------
+    user_ids : np.ndarray
+        User of each rating.
+    n_folds : int
+        Number of folds, each with its own random draw.
+    k : int
+        Ratings held out per user.
+    seed : int
+        Seed of the first fold's draw.
+
+    Yields
+    ------
+    tuple (np.ndarray, np.ndarray)
+        Boolean train and test masks over the ratings.
+
+    """
+    _, groups, counts = np.unique(user_ids, return_inverse=True,
+                                  return_counts=True)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    for fold in range(n_folds):
+        rng = np.random.default_rng(seed + fold)
+        # Shuffle within users; a rating's rank is its place in the shuffle.
+        order = np.lexsort((rng.random(len(groups)), groups))
+        rank = np.empty(len(groups), dtype=np.int64)
+        rank[order] = np.arange(len(groups)) - starts[groups[order]]
+        test = (rank < k) & (counts[groups] > k)
+        yield ~test, test
+
+def build_queries(ratings, movies, train, test, query_size, threshold,
+                  max_users=None, seed=0):
+    """Build the queries and expected movies of the test users of a fold.
+
+    Parameters
+    ----------
+    ratings : Pandas Dataframe
+        Ratings with `userId`, `rating` and `timestamp` columns.
+    movies : np.ndarray
+        Catalogue id of each rating's movie, -1 if not in the catalogue.
+    train, test : np.ndarray
+        Boolean masks of the fold's training and test ratings.
+    query_size : int
+        Number of favourite movies per query, the user's most recently
+        well-rated training movies.
+    threshold : float
+        Ratings at or above this count as liking a movie.
+    max_users : int, optional
+        Evaluate a random sample of this many users.
+    seed : int
+        Seed of the user sample.
+
+    Returns
+    -------
+    dict (str, np.ndarray)
+        The `QUERY_ARRAYS` of the fold.
+
+    """
+    liked = (ratings['rating'].to_numpy() >= threshold) & (movies >= 0)
+    frame = ratings.assign(movie=movies)
+    favourites = frame[train & liked].sort_values(
+        ['userId', 'timestamp'], ascending=[True, False], kind='stable')
+    favourites = favourites[favourites.groupby('userId').cumcount() < query_size]
+    relevant = frame[test & liked].sort_values('userId', kind='stable')
+    users = np.intersect1d(favourites['userId'].unique(),
+                           relevant['userId'].unique())
+    if max_users is not None and len(users) > max_users:
+        users = np.sort(np.random.default_rng(seed).choice(users, max_users,
+                                                           replace=False))
+    arrays = {'user_ids': users.astype(np.int32)}
+    for name, selected in (('query', favourites), ('relevant', relevant)):
+        selected = selected[selected['userId'].isin(users)]
+        _, counts = np.unique(selected['userId'].to_numpy(), return_counts=True)
+        arrays[name + '_offsets'] = np.concatenate([[0], np.cumsum(counts)])
+        arrays[name + '_movies'] = selected['movie'].to_numpy(dtype=np.int32)
+    return arrays
+
+def ranking_metrics(recommended, relevant, k):
+    """Precision@k, recall@k and NDCG@k of one list of recommendations.
+
+    Parameters
+    ----------
+    recommended : np.ndarray
+        Catalogue ids of the recommendations, best first; -1 for titles
+        missing from the catalogue.
+    relevant : np.ndarray
+        Catalogue ids of the movies the user liked.
+    k : int
+        Cut-off of the metrics.
+
+    Returns
+    -------
+    tuple (float, float, float)
+        Precision, recall and NDCG.
+
+    """
+    hits = np.isin(recommended[:k], relevant)
+    discounts = 1.0 / np.log2(np.arange(2, k + 2))
+    ideal = discounts[:min(len(relevant), k)].sum()
+    return (hits.sum() / k, hits.sum() / len(relevant),
+            float(discounts[:len(hits)][hits].sum() / ideal))
+
+# State of each worker process: the recommender and the fold's arrays.
+_worker = {}
+
+def _start_worker(algorithm, folder, factors_path, collab_mode, n_probe):
+    """Process pool initializer loading the recommender and the fold.
+
+    Parameters
+    ----------
+    algorithm : str
+        Key of `ALGORITHMS`.
+    folder : str
+        Folder holding the fold's `QUERY_ARRAYS`, opened memory-mapped.
+    factors_path : str or None
+        Factor bundle trained on the fold, replacing the served model.
+    collab_mode : str or None
+        Overrides `collaborative_based.COLLAB_MODE`.
+    n_probe : int or None
+        Overrides the ANN index's `n_probe`.
+
+    """
+    module_name, function_name = ALGORITHMS[algorithm]
+    module = importlib.import_module(module_name)
+    if algorithm != 'content':
+        from recommenders import collaborative_based
+        if factors_path is not None:
+            # Keep published versions from replacing the fold's model.
+            collaborative_based.MODEL_VERSIONS_PATH = folder
+            collaborative_based.use_model(
+                load_factors(factors_path), factors_path,
+                os.path.join(factors_path, 'ann.npz'))
+        if collab_mode is not None:
+            collaborative_based.COLLAB_MODE = collab_mode
+        if n_probe is not None:
+            collaborative_based.current_model().ann_index.n_probe = n_probe
+    _worker['model'] = getattr(module, function_name)
+    _worker['catalogue'] = get_catalogue(MOVIES_PATH)
+    _worker['arrays'] = {name: np.load(os.path.join(folder, name + '.npy'),
+                                       mmap_mode='r')
+                         for name in QUERY_ARRAYS}
+
+def evaluate_users(start, end, k):
+    """Replay the queries of users `start:end` of the fold.
+
+    Returns
+    -------
+    dict (str, np.ndarray)
+        Precision, recall, NDCG and latency (ms) of each user, and the
+        catalogue ids of every recommendation made, one entry per list.
+
+    """
+    model = _worker['model']
+    catalogue = _worker['catalogue']
+    arrays = _worker['arrays']
+    query_offsets = arrays['query_offsets']
+    relevant_offsets = arrays['relevant_offsets']
+    n_users = end - start
+    results = {name: np.zeros(n_users) for name in
+               ('precision', 'recall', 'ndcg', 'latency_ms')}
+    recommended_ids = []
+    for position, user in enumerate(range(start, end)):
+        query = catalogue.titles_of(
+            arrays['query_movies'][query_offsets[user]:query_offsets[user + 1]])
+        relevant = arrays['relevant_movies'][
+            relevant_offsets[user]:relevant_offsets[user + 1]]
+        begin = time.perf_counter()
+        titles = model(query, top_n=k)
+        results['latency_ms'][position] = (time.perf_counter() - begin) * 1000
+        recommended = np.array([-1 if movie is None else movie for movie in
+                                map(catalogue.id_of_title, titles)],
+                               dtype=np.int32)
+        (results['precision'][position], results['recall'][position],
+         results['ndcg'][position]) = ranking_metrics(recommended, relevant, k)
+        recommended_ids.append(recommended[recommended >= 0])
+    results['recommended'] = np.concatenate(recommended_ids or
+                                            [np.zeros(0, np.int32)])
+    return results
+
+def evaluate_fold(algorithm, folder, k, factors_path=None, collab_mode=None,
+                  n_probe=None, workers=0, block_size=64):
+    """Evaluate one recommender on the queries of one fold.
+
+    Parameters
+    ----------
+    algorithm : str
+        Key of `ALGORITHMS`.
+    folder : str
+        Folder holding the fold's `QUERY_ARRAYS`.
+    k : int
+        Number of recommendations per query, and cut-off of the metrics.
+    factors_path, collab_mode, n_probe : optional
+        Passed on to the workers; see `_start_worker`.
+    workers : int
+        Size of the process pool; 0 runs in the current process.
+    block_size : int
+        Users evaluated per task.
+
+    Returns
+    -------
+    dict
+        Mean metrics, catalogue coverage, the share of lists holding the
+        most recommended movie, and latency percentiles.
+
+    """
+    settings = (algorithm, folder, factors_path, collab_mode, n_probe)
+    n_users = len(np.load(os.path.join(folder, 'user_ids.npy'), mmap_mode='r'))
+    blocks = [(begin, min(begin + block_size, n_users), k)
+              for begin in range(0, n_users, block_size)]
+    if workers <= 0:
+        _start_worker(*settings)
+        parts = [evaluate_users(*block) for block in blocks]
+    else:
+        with ProcessPoolExecutor(workers, initializer=_start_worker,
+                                 initargs=settings) as executor:
+            parts = list(executor.map(evaluate_users, *zip(*blocks)))
+    results = {name: np.concatenate([part[name] for part in parts] or [[]])
+               for name in ('precision', 'recall', 'ndcg', 'latency_ms')}
+    _, counts = np.unique(np.concatenate([part['recommended'] for part in parts]
+                                         or [[]]), return_counts=True)
+    latency = results['latency_ms']
+    summary = {'users': n_users}
+    for name in ('precision', 'recall', 'ndcg'):
+        summary[f'{name}@{k}'] = round(float(results[name].mean()), 4) if n_users else None
+    summary['coverage'] = round(len(counts) / len(get_catalogue(MOVIES_PATH)), 4)
+    # Recommendations that hardly depend on the query (e.g. the same few
+    # well-rated movies for everyone) show up as a share close to 1.
+    summary['top_share'] = (round(int(counts.max()) / n_users, 4)
+                            if n_users and len(counts) else None)
+    summary['latency_mean_ms'] = round(float(latency.mean()), 2) if n_users else None
+    for percentile in (50, 95, 99):
+        summary[f'latency_p{percentile}_ms'] = (
+            round(float(np.percentile(latency, percentile)), 2) if n_users else None)
+    return summary
+
+def _train_als():
+    """Import `train_als` from the model training script."""
+    # Imported by name, so its pool workers can resolve its functions.
+    folder = os.path.dirname(os.path.abspath(TRAINER_PATH))
+    if folder not in sys.path:
+        sys.path.insert(0, folder)
+    return importlib.import_module('train_colbased').train_als
+
+def train_fold_model(ratings, train, folder, n_factors, n_epochs, workers):
+    """Fit ALS factors on a fold's training ratings, with their ANN index.
+
+    Returns
+    -------
+    str
+        Path of the factor bundle.
+
+    """
+    ratings_path = os.path.join(folder, 'train_ratings.csv')
+    factors_path = os.path.join(folder, 'factors')
+    ratings[train].to_csv(ratings_path, index=False)
+    _train_als()(ratings_path, factors_path, n_factors=n_factors,
+                 n_epochs=n_epochs, n_workers=workers or None)
+    # Build the ANN index once, before the workers open it.
+    from recommenders.collaborative_based import load_ann_index
+    load_ann_index(load_factors(factors_path).item_factors, factors_path,
+                   os.path.join(factors_path, 'ann.npz'))
+    return factors_path
+
+def evaluate(algorithms, split='time', n_folds=1, k=10, test_fraction=0.2,
+             leave_out=5, query_size=3, threshold=4.0, max_users=None,
+             retrain_factors=None, retrain_epochs=10, collab_mode=None,
+             n_probe=None, workers=0, seed=0, ratings_path=RATINGS_PATH):
+    """Evaluate recommenders over the folds of a split of the ratings.
+
+    Parameters
+    ----------
+    algorithms : list (str)
+        Keys of `ALGORITHMS` to evaluate.
+    split : str
+        'time' (rolling origin) or 'leave_k_out'.
+    n_folds : int
+        Number of folds.
+    k : int
+        Number of recommendations per query, and cut-off of the metrics.
+    test_fraction : float
+        Share of the ratings tested on per fold of the time split.
+    leave_out : int
+        Ratings held out per user in the leave-k-out split.
+    query_size : int
+        Number of favourite movies per query.
+    threshold : float
+        Ratings at or above this count as liking a movie.
+    max_users : int, optional
+        Evaluate a random sample of this many users per fold.
+    retrain_factors : int, optional
+        Fit ALS factors with this many factors on each fold's training
+        ratings for the collaborative and hybrid recommenders.
+    retrain_epochs : int
+        ALS epochs when retraining.
+    collab_mode : str, optional
+        Collaborative mode; defaults to `COLLAB_MODE`.
+    n_probe : int, optional
+        ANN clusters scanned per query; defaults to the index's own.
+    workers : int
+        Size of the process pools; 0 runs in the current process.
+    seed : int
+        Seed of the leave-k-out draws and user samples.
+    ratings_path : str
+        Ratings in .csv format.
+
+    Returns
+    -------
+    list (dict)
+        Settings and results of every algorithm and fold.
+
+    """
+    ratings = load_ratings(ratings_path)
+    movies = get_catalogue(MOVIES_PATH).ids_of_movie_ids(ratings['movieId'].to_numpy())
+    if split == 'time':
+        folds = time_split(ratings['timestamp'].to_numpy(), n_folds, test_fraction)
+    else:
+        folds = leave_k_out_split(ratings['userId'].to_numpy(), n_folds,
+                                  leave_out, seed)
+    rows = []
+    for fold, (train, test) in enumerate(folds):
+        with tempfile.TemporaryDirectory(prefix='evaluation-') as folder:
+            arrays = build_queries(ratings, movies, train, test, query_size,
+                                   threshold, max_users, seed + fold)
+            for name in QUERY_ARRAYS:
+                np.save(os.path.join(folder, name + '.npy'), arrays[name])
+            factors_path = None
+            if retrain_factors and set(algorithms) - {'content'}:
+                factors_path = train_fold_model(ratings, train, folder,
+                                                retrain_factors, retrain_epochs,
+                                                workers)
+            for algorithm in algorithms:
+                start = time.perf_counter()
+                summary = evaluate_fold(algorithm, folder, k, factors_path,
+                                        collab_mode, n_probe, workers)
+                rows.append({'algorithm': algorithm, 'split': split,
+                             'fold': fold, 'collab_mode': collab_mode,
+                             'n_probe': n_probe, 'factors': retrain_factors,
+                             'wall_s': round(time.perf_counter() - start, 1),
+                             **summary})
+    return rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Evaluate the recommenders offline on held-out ratings.')
+    parser.add_argument('--algorithm', nargs='+', choices=sorted(ALGORITHMS),
+                        default=['content', 'collaborative'])
+    parser.add_argument('--split', choices=['time', 'leave_k_out'],
+                        default='time')
+    parser.add_argument('--folds', type=int, default=1)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--test-fraction', type=float, default=0.2)
+    parser.add_argument('--leave-out', type=int, default=5)
+    parser.add_argument('--query-size', type=int, default=3)
+    parser.add_argument('--threshold', type=float, default=4.0)
+    parser.add_argument('--max-users', type=int, default=None)
+    parser.add_argument('--retrain-factors', type=int, default=None,
+                        help='Fit ALS factors on each fold with this many factors.')
+    parser.add_argument('--retrain-epochs', type=int, default=10)
+    parser.add_argument('--collab-mode', choices=['fold_in', 'ann',
+                                                  'neighbourhood'])
+    parser.add_argument('--n-probe', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Process pool size; 0 runs in-process.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--ratings', default=RATINGS_PATH)
+    parser.add_argument('--output', help='Write the results to a JSON file.')
+    args = parser.parse_args()
+
+    rows = evaluate(args.algorithm, args.split, args.folds, args.k,
+                    args.test_fraction, args.leave_out, args.query_size,
+                    args.threshold, args.max_users, args.retrain_factors,
+                    args.retrain_epochs, args.collab_mode, args.n_probe,
+                    args.workers, args.seed, args.ratings)
+    k = args.k
+    print(f"{'algorithm':<14} {'fold':>4} {'users':>6} {f'P@{k}':>7} "
+          f"{f'R@{k}':>7} {f'NDCG@{k}':>8} {'cover':>6} {'top':>6} "
+          f"{'p50 ms':>8} {'p95 ms':>8}")
+    for row in rows:
+        print(f"{row['algorithm']:<14} {row['fold']:>4} {row['users']:>6} "
+              f"{row[f'precision@{k}']:>7} {row[f'recall@{k}']:>7} "
+              f"{row[f'ndcg@{k}']:>8} {row['coverage']:>6} {row['top_share']!s:>6} "
+              f"{row['latency_p50_ms']:>8} {row['latency_p95_ms']:>8}")
+    for row in rows:
+        if row['top_share'] is not None and row['top_share'] > TOP_SHARE_LIMIT:
+            print(f"warning: {row['algorithm']} recommends the same movie to "
+                  f"{row['top_share']:.0%} of users in fold {row['fold']}; "
+                  "its recommendations barely depend on the chosen movies.")
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(rows, output_file, indent=2)
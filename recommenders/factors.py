@@ -0,0 +1,607 @@
+"""
+
+    Compact storage of trained matrix factorisation models.
+
+    Author: Explore Data Science Academy.
+
+    Description: A trained SVD-style model is fully described by its
+    global mean, user/item biases and user/item factor matrices, plus
+    the MovieLens ids of its rows. These are stored as one `.npy` file per
+    array in a bundle folder (float32 parameters, int32 ids), with a
+    versioned `meta.json` header, so the app can open them memory-mapped
+    instead of unpickling a full Surprise object with its trainset. The
+    header also records the shape and dtype of every array and a
+    fingerprint of the ratings and movies the model was trained for, which
+    is checked against the current data when the model is loaded. A
+    bundle converted from a pickled model records the size and
+    modification time of the pickle, so a replaced pickle can be told
+    from the one the bundle was made of.
+
+    A bundle path such as `SVD_factors` is a symbolic link to the latest
+    bundle written next to it (`SVD_factors.bundle-<time>`), swapped with
+    `os.replace`, so a reader never finds the path missing or half
+    written while a new bundle is saved.
+
+    Usage:
+
+        python -m recommenders.factors convert resources/models/SVD.pkl \
+            resources/models/SVD_factors
+        python -m recommenders.factors check resources/models/SVD_factors
+
+"""
+# Script dependencies
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import time
+import numpy as np
+
+FACTORS_FORMAT_VERSION = 2
+# Bundles of these versions can still be read.
+SUPPORTED_VERSIONS = (1, 2)
+ARRAYS = ('user_biases', 'item_biases', 'user_factors', 'item_factors',
+          'user_ids', 'item_ids')
+RATINGS_PATH = 'resources/data/ratings.csv'
+MOVIES_PATH = 'resources/data/movies.csv'
+# Share of the model's movies that must be in `movies.csv`; below this the
+# model was trained for a different dataset.
+MIN_ITEM_OVERLAP = 0.5
+
+class FactorModel:
+    """Parameters of a biased matrix factorisation model.
+
+    A rating is estimated as
+    `global_mean + user_biases[u] + item_biases[i] + user_factors[u] @ item_factors[i]`,
+    where `u` and `i` are inner ids, i.e. row positions. `user_ids` and
+    `item_ids` hold the MovieLens id of each row, `dataset` the
+    `data_fingerprint` of the data the model was trained for, if known,
+    `source` the `source_stamp` of the pickle it was converted from, and
+    `base` the `bundle_stamp` of the base bundle an incrementally updated
+    model was derived from.
+
+    """
+    def __init__(self, global_mean, rating_scale, user_biases, item_biases,
+                 user_factors, item_factors, user_ids, item_ids, dataset=None,
+                 source=None, base=None):
+        self.global_mean = float(global_mean)
+        self.rating_scale = tuple(rating_scale)
+        self.user_biases = user_biases
+        self.item_biases = item_biases
+        self.user_factors = user_factors
+        self.item_factors = item_factors
+        self.user_ids = user_ids
+        self.item_ids = item_ids
+        # Fingerprint of the data the model was trained for, if known.
+        self.dataset = dataset
+        # Stamp of the pickled model this one was converted from, if any.
+        self.source = source
+        # Stamp of the base bundle this model was updated from, if any.
+        self.base = base
+        self._user_index = None
+        self._item_index = None
+
+    @property
+    def n_factors(self):
+        return self.item_factors.shape[1]
+
+    @property
+    def user_index(self):
+        """Map of MovieLens user id to inner id."""
+        if self._user_index is None:
+            self._user_index = {uid: inner for inner, uid
+                                in enumerate(self.user_ids.tolist())}
+        return self._user_index
+
+    @property
+    def item_index(self):
+        """Map of MovieLens movie id to inner id."""
+        if self._item_index is None:
+            self._item_index = {iid: inner for inner, iid
+                                in enumerate(self.item_ids.tolist())}
+        return self._item_index
+
+def from_surprise(model):
+    """Extract the parameters of a fitted Surprise `SVD` model.
+
+    Parameters
+    ----------
+    model : surprise.SVD
+        Fitted model, including its trainset.
+
+    Returns
+    -------
+    FactorModel
+        The model's parameters and id maps.
+
+    """
+    trainset = model.trainset
+    user_ids = np.empty(trainset.n_users, dtype=np.int64)
+    for raw_uid, inner_uid in trainset._raw2inner_id_users.items():
+        user_ids[inner_uid] = raw_uid
+    item_ids = np.empty(trainset.n_items, dtype=np.int64)
+    for raw_iid, inner_iid in trainset._raw2inner_id_items.items():
+        item_ids[inner_iid] = raw_iid
+    if model.biased:
+        global_mean = trainset.global_mean
+        user_biases = np.asarray(model.bu)
+        item_biases = np.asarray(model.bi)
+    else:
+        global_mean = 0.0
+        user_biases = np.zeros(trainset.n_users)
+        item_biases = np.zeros(trainset.n_items)
+    return FactorModel(global_mean, trainset.rating_scale, user_biases,
+                       item_biases, np.asarray(model.pu), np.asarray(model.qi),
+                       user_ids, item_ids)
+
+def _ids_digest(*id_arrays):
+    """Hex digest of arrays of ids, independent of their integer dtype."""
+    digest = hashlib.sha1()
+    for ids in id_arrays:
+        digest.update(np.ascontiguousarray(ids, dtype=np.int64).tobytes())
+        digest.update(b';')
+    return digest.hexdigest()
+
+def data_fingerprint(rating_user_ids, rating_movie_ids, movie_ids=None):
+    """Fingerprint the ratings and movies a model is trained for.
+
+    The fingerprint is computed from the ids in the data rather than from
+    the files, so it survives copies and re-encodings of the same data.
+
+    Parameters
+    ----------
+    rating_user_ids, rating_movie_ids : np.ndarray
+        Distinct, sorted MovieLens user and movie ids of the ratings.
+    movie_ids : np.ndarray, optional
+        MovieLens ids of the movie catalogue, in file order.
+
+    Returns
+    -------
+    dict
+        Id counts and digests of the ratings and (if given) the movies.
+
+    """
+    fingerprint = {'ratings': {'users': len(rating_user_ids),
+                               'movies': len(rating_movie_ids),
+                               'sha1': _ids_digest(rating_user_ids,
+                                                   rating_movie_ids)},
+                   'movies': None}
+    if movie_ids is not None:
+        fingerprint['movies'] = {'movies': len(movie_ids),
+                                 'sha1': _ids_digest(movie_ids)}
+    return fingerprint
+
+def catalogue_movie_ids(movies_path=MOVIES_PATH):
+    """MovieLens ids of the movie catalogue, as taken by `data_fingerprint`.
+
+    These are the ids of the catalogue the app serves, i.e. without the
+    movies it drops for missing fields, so that fingerprints recorded by
+    the trainers match the app's.
+
+    """
+    from recommenders.catalogue import get_catalogue
+
+    return get_catalogue(movies_path).movie_ids
+
+def data_ids(ratings_path=RATINGS_PATH, movies_path=MOVIES_PATH):
+    """Ids of a ratings file and a movies file, as taken by `data_fingerprint`."""
+    from utils.data_loader import load_ratings
+
+    ratings = load_ratings(ratings_path)
+    return (np.unique(ratings['userId'].to_numpy()),
+            np.unique(ratings['movieId'].to_numpy()),
+            catalogue_movie_ids(movies_path))
+
+def check_compatibility(model, rating_user_ids, rating_movie_ids, movie_ids,
+                        min_item_overlap=MIN_ITEM_OVERLAP):
+    """Check that a model can serve recommendations for the current data.
+
+    A model whose recorded fingerprint matches the data is accepted as
+    is. Otherwise its users and movies are compared with the data: too
+    few of its movies in the catalogue means it was trained for another
+    dataset, while partial overlaps (e.g. new ratings since training) are
+    reported as warnings.
+
+    Parameters
+    ----------
+    model : FactorModel
+        Model to check.
+    rating_user_ids, rating_movie_ids : np.ndarray
+        Distinct, sorted MovieLens user and movie ids of the ratings.
+    movie_ids : np.ndarray
+        MovieLens ids of the movie catalogue.
+    min_item_overlap : float
+        Least share of the model's movies that must be in the catalogue.
+
+    Returns
+    -------
+    list (str)
+        Warnings about the compatibility of model and data.
+
+    Raises
+    ------
+    ValueError
+        If the model was trained for a different dataset.
+
+    """
+    current = data_fingerprint(rating_user_ids, rating_movie_ids, movie_ids)
+    recorded = model.dataset or {}
+    if (recorded.get('ratings') == current['ratings']
+            and recorded.get('movies') in (None, current['movies'])):
+        return []
+    item_ids = np.asarray(model.item_ids)
+    user_ids = np.asarray(model.user_ids)
+    in_catalogue = np.isin(item_ids, movie_ids).mean() if len(item_ids) else 0.0
+    if in_catalogue < min_item_overlap:
+        raise ValueError(f'Only {in_catalogue:.0%} of the model\'s movies are '
+                         'in the movie catalogue; it was trained for a '
+                         'different dataset')
+    warnings = []
+    if recorded.get('ratings') and recorded['ratings'] != current['ratings']:
+        warnings.append('The model was trained on different ratings')
+    if in_catalogue < 1:
+        warnings.append(f'{np.sum(~np.isin(item_ids, movie_ids))} of the '
+                        f'model\'s {len(item_ids)} movies are not in the '
+                        'movie catalogue')
+    unknown_users = np.sum(~np.isin(rating_user_ids, user_ids))
+    unknown_movies = np.sum(~np.isin(rating_movie_ids, item_ids))
+    if unknown_users or unknown_movies:
+        warnings.append(f'{unknown_users} users and {unknown_movies} movies '
+                        'of the ratings are unknown to the model')
+    return warnings
+
+def write_bundle(model, folder):
+    """Write the arrays and header of a model to a new bundle folder.
+
+    The folder is written in place; `save_factors` and `publish_factors`
+    only make it visible once it is complete.
+
+    Parameters
+    ----------
+    model : FactorModel
+        Model to store. Factors and biases are stored as float32, ids as
+        int32.
+    folder : str
+        Destination folder; created if it does not exist.
+
+    """
+    os.makedirs(folder, exist_ok=True)
+    arrays = {}
+    for name in ARRAYS:
+        values = np.asarray(getattr(model, name))
+        if name.endswith('_ids'):
+            if len(values) and (values.min() < np.iinfo(np.int32).min
+                                or values.max() > np.iinfo(np.int32).max):
+                raise ValueError(f'{name} do not fit in int32')
+            values = np.ascontiguousarray(values, dtype=np.int32)
+        else:
+            values = np.ascontiguousarray(values, dtype=np.float32)
+        np.save(os.path.join(folder, name + '.npy'), values)
+        arrays[name] = {'dtype': values.dtype.str, 'shape': list(values.shape)}
+    created = datetime.datetime.now(datetime.timezone.utc)
+    meta = {'version': FACTORS_FORMAT_VERSION,
+            'created': created.isoformat(timespec='seconds'),
+            'global_mean': model.global_mean,
+            'rating_scale': list(model.rating_scale),
+            'n_factors': int(model.n_factors),
+            'n_users': len(model.user_ids),
+            'n_items': len(model.item_ids),
+            'arrays': arrays,
+            'dataset': model.dataset,
+            'source': model.source,
+            'base': model.base}
+    with open(os.path.join(folder, 'meta.json'), 'w') as meta_file:
+        json.dump(meta, meta_file)
+
+def save_factors(model, folder):
+    """Write a model to a bundle path, atomically replacing any existing
+       bundle.
+
+    The bundle is written in full to a sibling folder, and `folder` is
+    then pointed at it by replacing a symbolic link. The bundle it
+    pointed at before is kept, for readers still opening it; older ones
+    are removed. Where symbolic links are not available the new bundle
+    is renamed into place instead, leaving the path briefly missing.
+
+    Parameters
+    ----------
+    model : FactorModel
+        Model to store.
+    folder : str
+        Destination bundle path.
+
+    """
+    folder = os.path.abspath(folder)
+    parent, name = os.path.split(folder)
+    prefix = name + '.bundle-'
+    bundle = '{}{:020d}-{}'.format(prefix, time.time_ns(), os.getpid())
+    write_bundle(model, os.path.join(parent, bundle))
+    link = os.path.join(parent, '{}.link-{}'.format(name, os.getpid()))
+    try:
+        if os.path.lexists(link):
+            os.remove(link)
+        os.symlink(bundle, link, target_is_directory=True)
+    except (OSError, NotImplementedError):
+        link = None
+    previous = (os.path.basename(os.readlink(folder))
+                if os.path.islink(folder) else None)
+    retired = None
+    if os.path.isdir(folder) and previous is None:
+        # A plain bundle folder, as written before links were used or
+        # where they are not available.
+        retired = os.path.join(parent, '{}.old-{}'.format(name, os.getpid()))
+        os.rename(folder, retired)
+    if link is None:
+        os.rename(os.path.join(parent, bundle), folder)
+    else:
+        os.replace(link, folder)
+    if retired is not None:
+        shutil.rmtree(retired, ignore_errors=True)
+    if previous is not None:
+        for old in os.listdir(parent):
+            if old.startswith(prefix) and old < previous:
+                shutil.rmtree(os.path.join(parent, old), ignore_errors=True)
+
+def load_factors(folder, mmap_mode='r'):
+    """Open a model bundle.
+
+    Parameters
+    ----------
+    folder : str
+        Bundle folder written by `save_factors`.
+    mmap_mode : str or None
+        Memory-map mode passed to `np.load`; None reads the arrays into
+        memory.
+
+    Returns
+    -------
+    FactorModel
+        The stored model.
+
+    Raises
+    ------
+    ValueError
+        If the bundle version is not supported, or an array does not
+        match the header.
+
+    """
+    with open(os.path.join(folder, 'meta.json')) as meta_file:
+        meta = json.load(meta_file)
+    if meta.get('version') not in SUPPORTED_VERSIONS:
+        raise ValueError(f"Unsupported factor bundle version {meta.get('version')}"
+                         f" in {folder}")
+    arrays = {name: np.load(os.path.join(folder, name + '.npy'),
+                            mmap_mode=mmap_mode, allow_pickle=False)
+              for name in ARRAYS}
+    for name, expected in meta.get('arrays', {}).items():
+        if (arrays[name].dtype.str != expected['dtype']
+                or list(arrays[name].shape) != expected['shape']):
+            raise ValueError(f'{name}.npy in {folder} does not match its header')
+    return FactorModel(meta['global_mean'], meta['rating_scale'],
+                       dataset=meta.get('dataset'), source=meta.get('source'),
+                       base=meta.get('base'), **arrays)
+
+def source_stamp(model_path):
+    """Size and modification time of a pickled model, as recorded by
+       `convert_pickle`.
+
+    Raises
+    ------
+    OSError
+        If the file cannot be read.
+
+    """
+    status = os.stat(model_path)
+    return {'size': status.st_size, 'mtime_ns': status.st_mtime_ns}
+
+def is_stale(folder, model_path):
+    """Tell whether a bundle is older than the pickle it was converted from.
+
+    A bundle that records its source is stale when the pickle's stamp has
+    changed since. One that does not (written by a trainer, or converted
+    before stamps were recorded) is stale when the pickle is newer than
+    the bundle.
+
+    Parameters
+    ----------
+    folder : str
+        Bundle folder.
+    model_path : str
+        Pickled Surprise model the bundle may have been converted from.
+
+    Returns
+    -------
+    bool
+        False when the pickle does not exist.
+
+    """
+    try:
+        stamp = source_stamp(model_path)
+    except OSError:
+        return False
+    meta_path = os.path.join(folder, 'meta.json')
+    with open(meta_path) as meta_file:
+        source = json.load(meta_file).get('source')
+    if source is not None:
+        return source != stamp
+    return stamp['mtime_ns'] > os.stat(meta_path).st_mtime_ns
+
+def bundle_stamp(folder):
+    """Size and modification time of a bundle's header, or None if there
+       is no bundle."""
+    try:
+        return source_stamp(os.path.join(folder, 'meta.json'))
+    except OSError:
+        return None
+
+def is_outdated(version, folder, model_path):
+    """Tell whether a published version derives from an older base model.
+
+    A version records the `bundle_stamp` of the base bundle its line of
+    updates started from, and is outdated once that bundle has been
+    rewritten (e.g. by the trainer) or its pickle replaced. A version
+    that does not record it is outdated when the base bundle or pickle
+    is newer than the version.
+
+    Parameters
+    ----------
+    version : str
+        Published version folder.
+    folder : str
+        Base bundle folder.
+    model_path : str
+        Pickled Surprise model the base bundle is converted from.
+
+    Returns
+    -------
+    bool
+        Whether the base model should be served instead of `version`.
+
+    """
+    version_meta = os.path.join(version, 'meta.json')
+    with open(version_meta) as meta_file:
+        base = json.load(meta_file).get('base')
+    published = os.stat(version_meta).st_mtime_ns
+    current = bundle_stamp(folder)
+    if current is None:
+        try:
+            return source_stamp(model_path)['mtime_ns'] > published
+        except OSError:
+            return False
+    if is_stale(folder, model_path):
+        return True
+    if base is not None:
+        return base != current
+    return current['mtime_ns'] > published
+
+def convert_pickle(model_path, folder, data=None):
+    """Convert a pickled Surprise model to a factor bundle.
+
+    Only the model's parameters and id maps are kept; its trainset is
+    dropped, and the pickle's `source_stamp` is recorded. The pickle must come from a trusted source, as unpickling
+    can run arbitrary code.
+
+    Parameters
+    ----------
+    model_path : str
+        Pickled, fitted Surprise `SVD` model.
+    folder : str
+        Destination bundle folder.
+    data : tuple (np.ndarray, np.ndarray, np.ndarray), optional
+        `data_ids` of the data the model was trained for. The model is
+        checked against them before it is written, and their
+        fingerprint is recorded in the bundle.
+
+    Returns
+    -------
+    tuple (FactorModel, list (str))
+        The model, opened from the new bundle, and the warnings of the
+        compatibility check.
+
+    """
+    import pickle
+
+    source = source_stamp(model_path)
+    with open(model_path, 'rb') as model_file:
+        model = from_surprise(pickle.load(model_file))
+    model.source = source
+    warnings = []
+    if data is not None:
+        warnings = check_compatibility(model, *data)
+        model.dataset = data_fingerprint(*data)
+    save_factors(model, folder)
+    return load_factors(folder), warnings
+
+def current_version(root):
+    """Locate the published model version under a versions folder.
+
+    Parameters
+    ----------
+    root : str
+        Folder holding `vNNNNNN` bundles and the `CURRENT` pointer.
+
+    Returns
+    -------
+    str or None
+        Path of the current bundle, or None if nothing was published.
+
+    """
+    try:
+        with open(os.path.join(root, 'CURRENT')) as pointer:
+            name = pointer.read().strip()
+    except OSError:
+        return None
+    return os.path.join(root, name) if name else None
+
+def publish_factors(model, root, keep=3):
+    """Store a model as a new version and atomically make it current.
+
+    The bundle is written in full before the `CURRENT` pointer is swapped
+    with `os.replace`, so readers only ever see complete versions.
+
+    Parameters
+    ----------
+    model : FactorModel
+        Model to publish.
+    root : str
+        Folder holding `vNNNNNN` bundles and the `CURRENT` pointer.
+    keep : int
+        Number of most recent versions kept on disk.
+
+    Returns
+    -------
+    str
+        Path of the published bundle.
+
+    """
+    os.makedirs(root, exist_ok=True)
+    versions = sorted(name for name in os.listdir(root)
+                      if name.startswith('v') and name[1:].isdigit())
+    number = int(versions[-1][1:]) + 1 if versions else 1
+    # Reserve the version folder so concurrent publishers never collide.
+    while True:
+        name = 'v{:06d}'.format(number)
+        try:
+            os.mkdir(os.path.join(root, name))
+            break
+        except FileExistsError:
+            number += 1
+    folder = os.path.join(root, name)
+    write_bundle(model, folder)
+    tmp_pointer = os.path.join(root, 'CURRENT.tmp-{}'.format(os.getpid()))
+    with open(tmp_pointer, 'w') as pointer:
+        pointer.write(name)
+    os.replace(tmp_pointer, os.path.join(root, 'CURRENT'))
+    for old in versions[:max(0, len(versions) + 1 - keep)]:
+        shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+    return folder
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Convert and check factor model bundles.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    convert = commands.add_parser(
+        'convert', help='Convert a pickled Surprise model to a bundle.')
+    convert.add_argument('model', help='Pickled Surprise model.')
+    convert.add_argument('output', help='Destination bundle folder.')
+    check = commands.add_parser(
+        'check', help='Check a bundle against the ratings and movies.')
+    check.add_argument('bundle', help='Bundle folder.')
+    for command in (convert, check):
+        command.add_argument('--ratings', default=RATINGS_PATH)
+        command.add_argument('--movies', default=MOVIES_PATH)
+    args = parser.parse_args()
+
+    data = data_ids(args.ratings, args.movies)
+    if args.command == 'convert':
+        model, warnings = convert_pickle(args.model, args.output, data)
+        print(f"Saved {len(model.user_ids)} users, {len(model.item_ids)} "
+              f"movies and {model.n_factors} factors to {args.output}")
+    else:
+        warnings = check_compatibility(load_factors(args.bundle), *data)
+        print(f"{args.bundle} is compatible with {args.ratings} and "
+              f"{args.movies}")
+    for warning in warnings:
+        print(f'Warning: {warning}')
@@ -0,0 +1,206 @@
+"""
+
+    Hybrid content / collaborative recommendation.
+
+    Author: Explore Data Science Academy.
+
+    Description: Blends the content-based and collaborative signals in a
+    single ranking. Candidates are generated cheaply from each side: the
+    precomputed similar-items tables when they are up to date, otherwise
+    the content similarity of the chosen movies and an ANN search of the
+    SVD item factor space. Only that candidate set is then scored with
+    both signals (genre/feature cosine, and the rating the SVD model
+    predicts for a pseudo-user folded in from the chosen movies),
+    penalised for popularity, and re-ranked greedily for diversity
+    (maximal marginal relevance), so the cost of the re-ranking grows
+    with the number of candidates rather than the catalogue.
+
+"""
+# Script dependencies
+import os
+import numpy as np
+
+from recommenders import collaborative_based, content_based
+from recommenders.catalogue import get_catalogue
+from recommenders.ranking import top_k
+from recommenders.similar_items import get_table
+from utils.tracing import span, traced
+
+# Blend of the two signals, each scaled to [0, 1] over the candidates.
+CONTENT_WEIGHT = float(os.environ.get('HYBRID_CONTENT_WEIGHT', 0.5))
+COLLAB_WEIGHT = float(os.environ.get('HYBRID_COLLAB_WEIGHT', 0.5))
+# Penalty on (log) popularity, favouring less obvious recommendations.
+POPULARITY_PENALTY = float(os.environ.get('HYBRID_POPULARITY_PENALTY', 0.1))
+# Penalty on the similarity to movies already recommended.
+DIVERSITY_PENALTY = float(os.environ.get('HYBRID_DIVERSITY_PENALTY', 0.3))
+# Candidates taken from each of the two sides.
+N_CANDIDATES = int(os.environ.get('HYBRID_CANDIDATES', 100))
+
+catalogue = get_catalogue(content_based.MOVIES_PATH)
+
+def _popularity():
+    """Log number of ratings of every catalogue movie, scaled to [0, 1]."""
+    counts = np.bincount(collaborative_based.ratings_matrix.indices,
+                         minlength=collaborative_based.ratings_matrix.shape[1])
+    popularity = np.zeros(len(catalogue), dtype=np.float32)
+    known = collaborative_based.column_movies >= 0
+    popularity[collaborative_based.column_movies[known]] = np.log1p(counts[known])
+    return popularity / max(float(popularity.max()), 1.0)
+
+popularity = _popularity()
+
+def _scale(values):
+    """Min-max scale scores to [0, 1]."""
+    spread = values.max() - values.min() if len(values) else 0
+    if spread <= 0:
+        return np.zeros_like(values)
+    return (values - values.min()) / spread
+
+def content_candidates(chosen, k):
+    """Catalogue ids of the k movies most similar in content to each of
+    `chosen`, read from the similar-items table when it is up to date
+    and holds at least k neighbours per movie."""
+    table = get_table('content', content_based.similarity_fingerprint)
+    if table is not None and table.neighbours.shape[1] >= k:
+        return np.asarray(table.neighbours[chosen, :k]).ravel()
+    matrix = content_based.content_index.matrix
+    similarity = (matrix @ matrix[chosen].T).toarray()
+    return np.concatenate([top_k(scores, k, exclude=chosen)
+                           for scores in similarity.T])
+
+def collab_candidates(items, k, state):
+    """Catalogue ids of the k movies closest to each of `items` in SVD
+    factor space, read from the similar-items table when it is up to date
+    and holds at least k neighbours per movie."""
+    table = get_table('collaborative', state.similarity_fingerprint)
+    if table is not None and table.neighbours.shape[1] >= k:
+        found = np.asarray(table.neighbours[items, :k]).ravel()
+    else:
+        ann_index = state.ann_index
+        found = np.concatenate([ann_index.search(ann_index.vectors[item], k,
+                                                 exclude=items)[0]
+                                for item in items])
+    return state.item_movies[found]
+
+def hybrid_scores(chosen, items, candidates, weights, state):
+    """Blend the content and collaborative scores of candidate movies.
+
+    Parameters
+    ----------
+    chosen : np.ndarray
+        Catalogue ids of the chosen movies.
+    items : list (int)
+        Inner SVD ids of the chosen movies known to the model.
+    candidates : np.ndarray
+        Catalogue ids of the candidate movies.
+    weights : tuple (float, float, float)
+        Content weight, collaborative weight and popularity penalty.
+    state : collaborative_based.ServedModel
+        Snapshot of the collaborative model to score with.
+
+    Returns
+    -------
+    np.ndarray
+        Relevance of each candidate.
+
+    """
+    content_weight, collab_weight, popularity_penalty = weights
+    matrix = content_based.content_index.matrix
+    content = (matrix[candidates] @ matrix[chosen].T).max(axis=1)
+    content = _scale(content.toarray().ravel())
+    collab = np.zeros(len(candidates))
+    candidate_items = state.movie_items[candidates]
+    known = candidate_items >= 0
+    if items and known.any():
+        user = collaborative_based.fold_in_user(items, state)
+        estimates = collaborative_based.fold_in_scores(
+            user, state, candidate_items[known])
+        # Movies the model does not know rank with its worst candidates.
+        collab[:] = estimates.min()
+        collab[known] = estimates
+        collab = _scale(collab)
+    return (content_weight * content + collab_weight * collab
+            - popularity_penalty * popularity[candidates])
+
+def diversify(candidates, relevance, top_n, penalty):
+    """Greedy maximal-marginal-relevance selection.
+
+    Each step picks the candidate with the best relevance minus `penalty`
+    times its highest content similarity to the movies already picked.
+
+    Returns
+    -------
+    np.ndarray
+        Catalogue ids of the selected movies, in order.
+
+    """
+    top_n = min(top_n, len(candidates))
+    if penalty <= 0:
+        return candidates[np.argsort(-relevance, kind='stable')[:top_n]]
+    vectors = content_based.content_index.matrix[candidates]
+    similarity = (vectors @ vectors.T).toarray()
+    redundancy = np.zeros(len(candidates))
+    available = np.ones(len(candidates), dtype=bool)
+    selected = []
+    for _ in range(top_n):
+        marginal = np.where(available, relevance - penalty * redundancy, -np.inf)
+        best = int(np.argmax(marginal))
+        selected.append(best)
+        available[best] = False
+        np.maximum(redundancy, similarity[best], out=redundancy)
+    return candidates[selected]
+
+@traced()
+def hybrid_model(movie_list, top_n=10, content_weight=None, collab_weight=None,
+                 popularity_penalty=None, diversity_penalty=None):
+    """Recommend movies using both the content and collaborative signals.
+
+    Parameters
+    ----------
+    movie_list : list (str)
+        Favorite movies chosen by the app user.
+    top_n : int
+        Number of top recommendations to return to the user.
+    content_weight, collab_weight : float, optional
+        Weights of the two signals; default to `CONTENT_WEIGHT` and
+        `COLLAB_WEIGHT`.
+    popularity_penalty, diversity_penalty : float, optional
+        Default to `POPULARITY_PENALTY` and `DIVERSITY_PENALTY`.
+
+    Returns
+    -------
+    list (str)
+        Titles of the top-n movie recommendations to the user.
+
+    """
+    collaborative_based.refresh_model()
+    state = collaborative_based.current_model()
+    weights = (CONTENT_WEIGHT if content_weight is None else content_weight,
+               COLLAB_WEIGHT if collab_weight is None else collab_weight,
+               POPULARITY_PENALTY if popularity_penalty is None
+               else popularity_penalty)
+    diversity_penalty = (DIVERSITY_PENALTY if diversity_penalty is None
+                         else diversity_penalty)
+    chosen = np.unique(catalogue.ids_of_titles(movie_list))
+    if not len(chosen):
+        return []
+    items = state.movie_items[chosen]
+    items = items[items >= 0].tolist()
+    with span('hybrid.candidates'):
+        pools = [content_candidates(chosen, N_CANDIDATES)]
+        if items:
+            pools.append(collab_candidates(items, N_CANDIDATES, state))
+        candidates = np.unique(np.concatenate(pools))
+        candidates = candidates[(candidates >= 0)
+                                & ~np.isin(candidates, chosen)].astype(np.int32)
+    if not len(candidates):
+        return []
+    with span('hybrid.score', candidates=len(candidates)):
+        relevance = hybrid_scores(chosen, items, candidates, weights, state)
+    with span('hybrid.rerank'):
+        selected = diversify(candidates, relevance, top_n, diversity_penalty)
+    return catalogue.titles_of(selected)
+
+def batch_hybrid_model(movie_lists, top_n=10):
+    """Performs hybrid filtering for many lists of movies."""
+    return [hybrid_model(movie_list, top_n) for movie_list in movie_lists]
@@ -0,0 +1,135 @@
+"""
+
+    Incremental updates of the collaborative model.
+
+    Author: Explore Data Science Academy.
+
+    Description: Folds a batch of new ratings into the current SVD model
+    without retraining on the full ratings file. Unknown users and movies
+    get freshly initialised rows, and a few epochs of SGD (the update
+    rule of Surprise's `SVD`) are run over the new ratings only, so just
+    the factors and biases of the affected users and movies change. The
+    result is published as a new model version; running app processes
+    pick it up on their next request.
+
+    Usage:
+
+        python -m recommenders.incremental new_ratings.csv --epochs 10
+
+"""
+# Script dependencies
+import argparse
+import numpy as np
+import pandas as pd
+
+from recommenders.factors import FactorModel, publish_factors
+
+def _extend(ids, biases, factors, new_ids, rng, init_std_dev):
+    """Append rows for ids the model has not seen, returning copies."""
+    known = set(ids.tolist())
+    unseen = [raw for raw in dict.fromkeys(new_ids.tolist()) if raw not in known]
+    ids = np.concatenate([ids, np.asarray(unseen, dtype=np.int64)])
+    biases = np.concatenate([biases, np.zeros(len(unseen))])
+    factors = np.vstack([factors, rng.normal(0, init_std_dev,
+                                             (len(unseen), factors.shape[1]))])
+    return ids, biases, factors
+
+def fold_in(model, new_ratings, n_epochs=10, lr=0.005, reg=0.02,
+            init_std_dev=0.05, seed=0):
+    """Update a model with a batch of new ratings.
+
+    Parameters
+    ----------
+    model : FactorModel
+        Current model; it is not modified.
+    new_ratings : Pandas Dataframe
+        New ratings with `userId`, `movieId` and `rating` columns.
+    n_epochs : int
+        SGD passes over the new ratings.
+    lr : float
+        SGD learning rate.
+    reg : float
+        L2 regularisation of factors and biases.
+    init_std_dev : float
+        Standard deviation of the initial factors of new users/movies.
+    seed : int
+        Seed of the initialisation and of the rating order.
+
+    Returns
+    -------
+    FactorModel
+        Updated model, including rows for new users and movies. It
+        keeps the dataset fingerprint and base bundle stamp of `model`.
+
+    """
+    rng = np.random.default_rng(seed)
+    new_users = new_ratings['userId'].to_numpy(dtype=np.int64)
+    new_items = new_ratings['movieId'].to_numpy(dtype=np.int64)
+    values = new_ratings['rating'].to_numpy(dtype=np.float64)
+    user_ids, user_biases, user_factors = _extend(
+        np.asarray(model.user_ids), np.asarray(model.user_biases, dtype=np.float64),
+        np.asarray(model.user_factors, dtype=np.float64), new_users, rng,
+        init_std_dev)
+    item_ids, item_biases, item_factors = _extend(
+        np.asarray(model.item_ids), np.asarray(model.item_biases, dtype=np.float64),
+        np.asarray(model.item_factors, dtype=np.float64), new_items, rng,
+        init_std_dev)
+    updated = FactorModel(model.global_mean, model.rating_scale, user_biases,
+                          item_biases, user_factors, item_factors, user_ids,
+                          item_ids, dataset=model.dataset, base=model.base)
+    users = np.array([updated.user_index[raw] for raw in new_users.tolist()])
+    items = np.array([updated.item_index[raw] for raw in new_items.tolist()])
+
+    mu = updated.global_mean
+    for _ in range(n_epochs):
+        for k in rng.permutation(len(values)):
+            u, i = users[k], items[k]
+            pu = user_factors[u].copy()
+            qi = item_factors[i]
+            err = values[k] - (mu + user_biases[u] + item_biases[i] + pu @ qi)
+            user_biases[u] += lr * (err - reg * user_biases[u])
+            item_biases[i] += lr * (err - reg * item_biases[i])
+            user_factors[u] += lr * (err * qi - reg * pu)
+            item_factors[i] += lr * (err * pu - reg * qi)
+    return updated
+
+def update_model(new_ratings, root, model=None, **kwargs):
+    """Fold new ratings into the current model and publish the result.
+
+    Parameters
+    ----------
+    new_ratings : Pandas Dataframe
+        New ratings with `userId`, `movieId` and `rating` columns.
+    root : str
+        Model versions folder the app loads from.
+    model : FactorModel, optional
+        Model to update; defaults to the model currently served by
+        `recommenders.collaborative_based`.
+    **kwargs
+        Passed on to `fold_in`.
+
+    Returns
+    -------
+    str
+        Path of the published model version.
+
+    """
+    if model is None:
+        from recommenders import collaborative_based
+        collaborative_based.refresh_model(wait=True)
+        model = collaborative_based.current_model().model
+    return publish_factors(fold_in(model, new_ratings, **kwargs), root)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Fold new ratings into the collaborative model.')
+    parser.add_argument('ratings', help='.csv of userId,movieId,rating rows.')
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--lr', type=float, default=0.005)
+    parser.add_argument('--reg', type=float, default=0.02)
+    args = parser.parse_args()
+
+    from recommenders.collaborative_based import MODEL_VERSIONS_PATH
+    path = update_model(pd.read_csv(args.ratings), MODEL_VERSIONS_PATH,
+                        n_epochs=args.epochs, lr=args.lr, reg=args.reg)
+    print(f"Published model version: {path}")
@@ -0,0 +1,48 @@
+"""
+
+    Shared ranking helpers for the recommender algorithms.
+
+    Author: Explore Data Science Academy.
+
+    Description: Top-k selection over dense score vectors. Selection is
+    done with `np.argpartition`, so the cost stays linear in the number
+    of candidates rather than requiring a full sort of the catalogue.
+
+"""
+# Script dependencies
+import numpy as np
+
+def top_k(scores, k, exclude=None):
+    """Select the positions of the k highest scores.
+
+    Parameters
+    ----------
+    scores : np.ndarray
+        One-dimensional array of scores, one per candidate item.
+    k : int
+        Number of positions to return.
+    exclude : array-like of int, optional
+        Positions which may never be returned (e.g. the movies the app
+        user already selected).
+
+    Returns
+    -------
+    np.ndarray
+        Positions of the top-k scores, best first. Ties are broken by
+        position so that results are deterministic.
+
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    if exclude is not None and len(exclude):
+        scores = scores.copy()
+        scores[np.asarray(exclude, dtype=np.intp)] = -np.inf
+    n_valid = int(np.count_nonzero(scores > -np.inf))
+    k = min(int(k), n_valid)
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    # Everything scoring at least the k-th best value is a candidate; this
+    # keeps tied items at the boundary so the final order is stable.
+    kth = scores[np.argpartition(-scores, k - 1)[:k]].min()
+    candidates = np.flatnonzero(scores >= kth)
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order[:k]]
@@ -0,0 +1,249 @@
+"""
+
+    Headless recommendation HTTP service.
+
+    Author: Explore Data Science Academy.
+
+    Description: Serves the content-based and collaborative recommenders
+    behind a small JSON API, so that recommendation work can run (and be
+    scaled) separately from the Streamlit UI. The recommender indexes and
+    model are loaded once per service process. Concurrent requests for
+    the same algorithm are collected for a few milliseconds and scored
+    together with the recommenders' batch functions on a worker pool.
+
+    Endpoints:
+
+      - `POST /recommend` with `{"algorithm": "content" | "collaborative" |
+        "hybrid", "movies": [...], "top_n": 10}` returns
+        `{"recommendations": [...]}`.
+      - `GET /health` returns `{"status": "ok"}`.
+
+    Usage:
+
+        python -m recommenders.service --port 8600 --workers 4
+
+"""
+# Script dependencies
+import argparse
+import importlib
+import json
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from recommenders.batch import ALGORITHMS
+
+logger = logging.getLogger(__name__)
+
+# Longest time a request waits for its batch to be scored.
+REQUEST_TIMEOUT = 30.0
+
+class MicroBatcher:
+    """Group concurrent recommendation requests into batch calls.
+
+    Requests are queued; a dispatcher thread takes the first waiting
+    request, keeps collecting for up to `max_wait` seconds or until
+    `max_batch` requests are gathered, and hands the batch to the worker
+    pool.
+
+    Parameters
+    ----------
+    function : callable
+        Batch recommender, `function(movie_lists, top_n)`.
+    executor : concurrent.futures.Executor
+        Worker pool the batches are scored on.
+    max_batch : int
+        Largest number of requests scored in one call.
+    max_wait : float
+        Seconds the dispatcher waits for more requests to join a batch.
+
+    """
+    def __init__(self, function, executor, max_batch=64, max_wait=0.005):
+        self.function = function
+        self.executor = executor
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, movie_list, top_n):
+        """Queue a request, returning a future of its recommendations."""
+        future = Future()
+        self._queue.put((movie_list, top_n, future))
+        return future
+
+    def _dispatch(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self.executor.submit(self._score, batch)
+
+    def _score(self, batch):
+        # Requests asking for different numbers of results are scored
+        # in separate calls.
+        by_top_n = {}
+        for movie_list, top_n, future in batch:
+            by_top_n.setdefault(top_n, []).append((movie_list, future))
+        for top_n, requests in by_top_n.items():
+            try:
+                results = self.function([movie_list for movie_list, _ in requests],
+                                        top_n)
+            except Exception as error:
+                logger.exception('Scoring a batch of %d requests failed',
+                                 len(requests))
+                for _, future in requests:
+                    future.set_exception(error)
+                continue
+            for (_, future), result in zip(requests, results):
+                future.set_result(result)
+
+class RecommenderService:
+    """Recommenders of every algorithm, sharing one worker pool.
+
+    Parameters
+    ----------
+    workers : int
+        Size of the worker pool scoring batches.
+    max_batch : int
+        Largest number of requests scored in one call.
+    max_wait : float
+        Seconds a batch stays open for more requests.
+
+    """
+    def __init__(self, workers=4, max_batch=64, max_wait=0.005):
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix='recommend')
+        self.batchers = {}
+        for algorithm, (module_name, function_name) in ALGORITHMS.items():
+            # Importing the module loads its data, index and model.
+            function = getattr(importlib.import_module(module_name), function_name)
+            self.batchers[algorithm] = MicroBatcher(function, self.executor,
+                                                    max_batch, max_wait)
+
+    def recommend(self, algorithm, movie_list, top_n=10):
+        """Recommend movies for one list of favourites.
+
+        Parameters
+        ----------
+        algorithm : str
+            'content', 'collaborative' or 'hybrid'.
+        movie_list : list (str)
+            Favorite movies chosen by the app user.
+        top_n : int
+            Number of top recommendations to return.
+
+        Returns
+        -------
+        list (str)
+            Titles of the top-n movie recommendations.
+
+        """
+        future = self.batchers[algorithm].submit(list(movie_list), top_n)
+        return future.result(timeout=REQUEST_TIMEOUT)
+
+class RecommendationHandler(BaseHTTPRequestHandler):
+    """JSON request handler; `server.service` is the RecommenderService."""
+    # Keep connections open so that clients can pool them; without Nagle's
+    # algorithm a response is not held back waiting for the client's ACK.
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        else:
+            self._send_json(404, {'error': f'Unknown path {self.path}'})
+
+    def do_POST(self):
+        if self.path != '/recommend':
+            self._send_json(404, {'error': f'Unknown path {self.path}'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length))
+            algorithm = request.get('algorithm', 'content')
+            movies = request['movies']
+            top_n = int(request.get('top_n', 10))
+            if algorithm not in ALGORITHMS:
+                raise ValueError(f'Unknown algorithm {algorithm!r}')
+            if not isinstance(movies, list) or top_n < 1:
+                raise ValueError("'movies' must be a list and 'top_n' positive")
+        except (KeyError, ValueError, TypeError, AttributeError) as error:
+            self._send_json(400, {'error': str(error)})
+            return
+        try:
+            recommendations = self.server.service.recommend(algorithm, movies, top_n)
+        except Exception as error:
+            self._send_json(500, {'error': repr(error)})
+            return
+        self._send_json(200, {'recommendations': recommendations})
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+def make_server(host='127.0.0.1', port=8600, service=None):
+    """Create the HTTP server; call `serve_forever()` to run it.
+
+    Parameters
+    ----------
+    host : str
+        Interface to listen on.
+    port : int
+        Port to listen on; 0 picks a free port.
+    service : RecommenderService, optional
+        Service answering requests; created with defaults if omitted.
+
+    Returns
+    -------
+    http.server.ThreadingHTTPServer
+        Server with the service attached as `server.service`.
+
+    """
+    server = ThreadingHTTPServer((host, port), RecommendationHandler)
+    server.daemon_threads = True
+    server.service = service or RecommenderService()
+    return server
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Serve movie recommendations over HTTP.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8600)
+    parser.add_argument('--workers', type=int, default=4,
+                        help='Threads scoring batches of requests.')
+    parser.add_argument('--max-batch', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=5.0,
+                        help='Time a batch stays open for more requests.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    service = RecommenderService(args.workers, args.max_batch,
+                                 args.max_wait_ms / 1000)
+    server = make_server(args.host, args.port, service)
+    logger.info('Serving recommendations on http://%s:%d', args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
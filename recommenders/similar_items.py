@@ -0,0 +1,285 @@
+"""
+
+    Precomputed top-K similar-items tables.
+
+    Author: Explore Data Science Academy.
+
+    Description: An offline job computes, for every movie, its K most
+    similar movies under the content (genre) similarity and under the
+    collaborative (SVD item factor) similarity. Each table is stored as
+    an int32 neighbour matrix and a float16 score matrix (`.npy` files,
+    opened memory-mapped) together with the fingerprint of the data the
+    table was built from. Serving a request then reduces to reading one
+    row per chosen movie and a small k-way merge of those sorted rows.
+    A table whose fingerprint no longer matches its data is ignored
+    until it is rebuilt.
+
+    Usage:
+
+        python -m recommenders.similar_items --kind content collaborative --k 50
+
+"""
+# Script dependencies
+import argparse
+import hashlib
+import heapq
+import json
+import os
+import time
+import numpy as np
+import scipy.sparse as sp
+
+from utils.data_loader import publish_folder, staging_folder
+
+TABLES_PATH = 'resources/models/similar_items'
+
+def dataset_fingerprint(*paths):
+    """Fingerprint the files a table is derived from.
+
+    Parameters
+    ----------
+    *paths : str
+        Source files (or bundle folders, through their `meta.json`).
+
+    Returns
+    -------
+    str
+        Hex digest of the paths, sizes and modification times.
+
+    """
+    digest = hashlib.sha1()
+    for path in paths:
+        if os.path.isdir(path):
+            path = os.path.join(path, 'meta.json')
+        stat = os.stat(path)
+        digest.update(f'{path}:{stat.st_size}:{stat.st_mtime_ns};'.encode())
+    return digest.hexdigest()
+
+def _similarities(vectors, rows):
+    """Cosine similarity of `rows` to every row of unit-length `vectors`."""
+    if sp.issparse(vectors):
+        query = vectors[rows]
+        # Only the features used by the query rows contribute.
+        features = np.unique(query.indices)
+        return np.ascontiguousarray(
+            query[:, features].toarray() @ vectors[:, features].T)
+    return np.asarray(vectors[rows]) @ np.asarray(vectors).T
+
+def build_table(vectors, k=50, chunk_size=512):
+    """Compute the top-k most similar rows of every row.
+
+    Parameters
+    ----------
+    vectors : np.ndarray or scipy.sparse matrix
+        Unit-length item vectors, one row per item.
+    k : int
+        Number of neighbours kept per item.
+    chunk_size : int
+        Rows processed per step; bounds the size of the dense block of
+        similarities held in memory.
+
+    Returns
+    -------
+    tuple (np.ndarray, np.ndarray)
+        Neighbour rows (int32) and their similarities (float16), each
+        of shape (n_items, k) and sorted best first.
+
+    """
+    n_items = vectors.shape[0]
+    k = min(k, n_items - 1)
+    neighbours = np.empty((n_items, k), dtype=np.int32)
+    scores = np.empty((n_items, k), dtype=np.float16)
+    for start in range(0, n_items, chunk_size):
+        rows = np.arange(start, min(start + chunk_size, n_items))
+        similarity = _similarities(vectors, rows)
+        # An item is not its own neighbour.
+        similarity[np.arange(len(rows)), rows] = -np.inf
+        # Keep everything above the k-th best score, then fill up with the
+        # earliest items tied at it, so ties resolve as in `ranking.top_k`.
+        threshold = -np.partition(-similarity, k - 1, axis=1)[:, k - 1:k]
+        above = similarity > threshold
+        tied = similarity == threshold
+        tied &= np.cumsum(tied, axis=1) <= k - above.sum(axis=1, keepdims=True)
+        best = np.nonzero(above | tied)[1].reshape(len(rows), k)
+        best_scores = np.take_along_axis(similarity, best, axis=1)
+        # Best first, ties in catalogue order as in `ranking.top_k`.
+        order = np.lexsort((best, -best_scores), axis=1)
+        neighbours[rows] = np.take_along_axis(best, order, axis=1)
+        scores[rows] = np.take_along_axis(best_scores, order, axis=1)
+    return neighbours, scores
+
+def save_table(folder, neighbours, scores, fingerprint):
+    """Write a similar-items table, atomically replacing any existing one.
+
+    The table is written to a private folder and published with
+    `publish_folder`, so a concurrent `get_table` finds either the old
+    table or the new one.
+
+    """
+    staging = staging_folder(folder)
+    np.save(os.path.join(staging, 'neighbours.npy'), neighbours)
+    np.save(os.path.join(staging, 'scores.npy'), scores)
+    with open(os.path.join(staging, 'meta.json'), 'w') as meta_file:
+        json.dump({'fingerprint': fingerprint, 'k': int(neighbours.shape[1]),
+                   'n_items': int(neighbours.shape[0])}, meta_file)
+    publish_folder(staging, folder)
+
+class SimilarItemsTable:
+    """Memory-mapped top-K neighbour table of one similarity kind.
+
+    Parameters
+    ----------
+    neighbours : np.ndarray
+        Neighbour rows (int32), best first.
+    scores : np.ndarray
+        Similarities (float16) matching `neighbours`.
+    fingerprint : str
+        Fingerprint of the data the table was built from.
+
+    """
+    def __init__(self, neighbours, scores, fingerprint):
+        self.neighbours = neighbours
+        self.scores = scores
+        self.fingerprint = fingerprint
+
+    @property
+    def k(self):
+        return self.neighbours.shape[1]
+
+    @classmethod
+    def load(cls, folder, fingerprint=None):
+        """Open a stored table.
+
+        Parameters
+        ----------
+        folder : str
+            Table folder written by `save_table`.
+        fingerprint : str, optional
+            Expected fingerprint; None is returned for tables built from
+            other data.
+
+        Returns
+        -------
+        SimilarItemsTable or None
+            The table, or None when it is missing or stale.
+
+        """
+        try:
+            with open(os.path.join(folder, 'meta.json')) as meta_file:
+                meta = json.load(meta_file)
+        except (OSError, ValueError):
+            return None
+        if fingerprint is not None and meta['fingerprint'] != fingerprint:
+            return None
+        return cls(np.load(os.path.join(folder, 'neighbours.npy'), mmap_mode='r'),
+                   np.load(os.path.join(folder, 'scores.npy'), mmap_mode='r'),
+                   meta['fingerprint'])
+
+    def recommend(self, rows, top_n):
+        """Merge the neighbour lists of the chosen rows.
+
+        Each row's neighbours are already sorted, so a k-way merge yields
+        candidates in order of their best similarity to any chosen row.
+
+        Parameters
+        ----------
+        rows : list (int)
+            Rows of the chosen items.
+        top_n : int
+            Number of items to return.
+
+        Returns
+        -------
+        list (int) or None
+            Rows of the top-n items, or None if the table is too short
+            to answer exactly and the caller should fall back.
+
+        """
+        if top_n + len(rows) > self.k:
+            return None
+        streams = [zip((-self.scores[row]).tolist(), self.neighbours[row].tolist())
+                   for row in rows]
+        excluded = set(rows)
+        found = []
+        for _, row in heapq.merge(*streams):
+            if row not in excluded:
+                excluded.add(row)
+                found.append(row)
+                if len(found) == top_n:
+                    break
+        return found
+
+# Tables opened by this process, keyed by kind.
+_tables = {}
+
+def get_table(kind, fingerprint):
+    """Return the table of a similarity kind if it matches the data.
+
+    Parameters
+    ----------
+    kind : str
+        'content' or 'collaborative'.
+    fingerprint : str
+        Fingerprint of the data currently served.
+
+    Returns
+    -------
+    SimilarItemsTable or None
+        The table, or None when missing or built from other data.
+
+    """
+    table = _tables.get(kind)
+    if table is None or table.fingerprint != fingerprint:
+        table = SimilarItemsTable.load(os.path.join(TABLES_PATH, kind),
+                                       fingerprint)
+        _tables[kind] = table
+    return table
+
+def rebuild(kind, k=50, force=False):
+    """Build the table of one similarity kind if its data has changed.
+
+    Parameters
+    ----------
+    kind : str
+        'content' or 'collaborative'.
+    k : int
+        Number of neighbours kept per item.
+    force : bool
+        Rebuild even when the stored table is up to date.
+
+    Returns
+    -------
+    bool
+        Whether the table was rebuilt.
+
+    """
+    if kind == 'content':
+        from recommenders import content_based as source
+        vectors = source.content_index.matrix
+    else:
+        from recommenders.collaborative_based import current_model
+        source = current_model()
+        vectors = source.ann_index.vectors
+    fingerprint = source.similarity_fingerprint
+    folder = os.path.join(TABLES_PATH, kind)
+    if not force and SimilarItemsTable.load(folder, fingerprint) is not None:
+        return False
+    os.makedirs(TABLES_PATH, exist_ok=True)
+    save_table(folder, *build_table(vectors, k), fingerprint)
+    return True
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Precompute the top-K similar-items tables.')
+    parser.add_argument('--kind', nargs='+', default=['content', 'collaborative'],
+                        choices=['content', 'collaborative'])
+    parser.add_argument('--k', type=int, default=50)
+    parser.add_argument('--force', action='store_true',
+                        help='Rebuild even if the data has not changed.')
+    args = parser.parse_args()
+
+    for kind in args.kind:
+        start = time.perf_counter()
+        built = rebuild(kind, args.k, args.force)
+        print(f"{kind}: {'rebuilt' if built else 'up to date'} "
+              f"({time.perf_counter() - start:.1f}s)")
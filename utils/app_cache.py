@@ -0,0 +1,227 @@
+"""
+
+    Caching layer for the Streamlit app.
+
+    Author: Explore Data Science Academy.
+
+    Description: Streamlit reruns `edsa_recommender.py` on every widget
+    change. The helpers below make sure that reruns reuse work already
+    done: data and encoded images are cached with `st.cache_data`, the
+    title search index and recommendation results are shared by all
+    sessions of the process through `st.cache_resource`, and results are
+    memoised per (algorithm, movies, top_n) in a bounded LRU cache with
+    hit/miss counters. The recommender indexes and model are module
+    state of the recommenders, loaded once per process.
+
+    When `RECOMMENDER_SERVICE_URL` is set, recommendations come from the
+    headless recommendation service and the recommenders are never
+    loaded into the app process. Otherwise they are imported (loading
+    their data, indexes and model) on first use, or ahead of it by a
+    background warm-up thread unless `RECOMMENDER_WARM_UP` is '0'.
+
+"""
+# Dependencies
+import base64
+import functools
+import importlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import streamlit as st
+
+from utils.data_loader import load_movie_titles
+from utils.service_client import get_service_client
+from utils.title_search import TitleIndex
+from utils.tracing import reported_errors, span
+
+logger = logging.getLogger(__name__)
+
+WARM_UP = os.environ.get('RECOMMENDER_WARM_UP', '1') != '0'
+# Modules loaded by the warm-up thread, in order.
+WARM_UP_MODULES = ('recommenders.content_based',
+                   'recommenders.collaborative_based', 'recommenders.hybrid')
+
+@st.cache_data
+def cached_movie_titles(path_to_movies):
+    """Movie titles, loaded once per process (see `load_movie_titles`)."""
+    return load_movie_titles(path_to_movies)
+
+def _warm_up(modules):
+    for name in modules:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except Exception:
+            # The first request reports the error; warming up is best effort.
+            logger.exception('Warming up %s failed', name)
+            return
+        logger.info('Warmed up %s in %.2fs', name, time.perf_counter() - start)
+
+@st.cache_resource
+def start_warm_up():
+    """Load the recommenders in a background thread, once per process.
+
+    The first page renders without waiting for the recommenders; a
+    recommendation requested before the warm-up has finished waits for
+    the module being loaded (Python's import lock) rather than loading
+    it a second time.
+
+    Returns
+    -------
+    threading.Thread or None
+        The warm-up thread, or None when warming up is disabled or the
+        recommendation service is used.
+
+    """
+    if not WARM_UP or get_service_client() is not None:
+        return None
+    thread = threading.Thread(target=_warm_up, args=(WARM_UP_MODULES,),
+                              name='recommender-warm-up', daemon=True)
+    thread.start()
+    return thread
+
+@st.cache_resource
+def title_search_index(path_to_movies):
+    """Search index over the movie titles, shared by all sessions."""
+    return TitleIndex(cached_movie_titles(path_to_movies))
+
+@st.cache_data
+def background_css(image_file):
+    """Build the page style setting `image_file` as the app background.
+
+    Parameters
+    ----------
+    image_file : str
+        Path to a .jpg image.
+
+    Returns
+    -------
+    str
+        A `<style>` block embedding the base64-encoded image.
+
+    """
+    with open(image_file, "rb") as image:
+        encoded_string = base64.b64encode(image.read())
+    return f"""
+        <style>
+        .stApp {{
+            background-image: url(data:image/{"jpg"};base64,{encoded_string.decode()});
+            background-size: cover
+        }}
+        </style>
+        """
+
+class RecommendationCache:
+    """Thread-safe bounded LRU cache of recommendation results.
+
+    Parameters
+    ----------
+    max_entries : int
+        Number of results kept; the least recently used are evicted.
+
+    """
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        """Return the cached result for `key`, computing it on a miss."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return list(self._entries[key])
+            self.misses += 1
+        result = compute()
+        with self._lock:
+            self._entries[key] = tuple(result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return list(result)
+
+    def stats(self):
+        """Hit/miss counters and current size of the cache."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'entries': len(self._entries)}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+@st.cache_resource
+def recommendation_cache():
+    """The recommendation result cache shared by all sessions."""
+    return RecommendationCache()
+
+def cached_recommendation(algorithm, model, movie_list, top_n):
+    """Memoise a call to one of the recommender `*_model` functions.
+
+    Parameters
+    ----------
+    algorithm : str
+        Name of the algorithm, used as part of the cache key.
+    model : callable
+        The recommender function, called on a cache miss.
+    movie_list : list (str)
+        Favorite movies chosen by the app user.
+    top_n : int
+        Number of top recommendations to return to the user.
+
+    Returns
+    -------
+    list (str)
+        Titles of the top-n movie recommendations to the user.
+
+    """
+    key = (algorithm, tuple(movie_list), top_n)
+    with reported_errors(f'{algorithm} recommendation for {movie_list!r}'), \
+            span('recommendation_cache', algorithm=str(algorithm)):
+        return recommendation_cache().get_or_compute(
+            key, lambda: model(movie_list=movie_list, top_n=top_n))
+
+def content_model(movie_list, top_n=10):
+    """Cached `recommenders.content_based.content_model`."""
+    client = get_service_client()
+    if client is not None:
+        model = functools.partial(client.recommend, 'content')
+    else:
+        from recommenders.content_based import content_model as model
+    return cached_recommendation('content', model, movie_list, top_n)
+
+def collab_model(movie_list, top_n=10):
+    """Cached `recommenders.collaborative_based.collab_model`."""
+    client = get_service_client()
+    if client is not None:
+        # The service hot-reloads model versions itself, so its results
+        # are not cached here.
+        with reported_errors(f'collaborative recommendation for {movie_list!r}'):
+            return client.recommend('collaborative', movie_list, top_n)
+    from recommenders import collaborative_based
+    # Results of earlier model versions must not be served after a
+    # hot reload, so the version is part of the algorithm key.
+    collaborative_based.refresh_model()
+    return cached_recommendation(('collaborative',
+                                  collaborative_based.current_model().version),
+                                 collaborative_based.collab_model,
+                                 movie_list, top_n)
+
+def hybrid_model(movie_list, top_n=10):
+    """Cached `recommenders.hybrid.hybrid_model`."""
+    client = get_service_client()
+    if client is not None:
+        with reported_errors(f'hybrid recommendation for {movie_list!r}'):
+            return client.recommend('hybrid', movie_list, top_n)
+    from recommenders import collaborative_based, hybrid
+    # The collaborative signal changes with the model version.
+    collaborative_based.refresh_model()
+    return cached_recommendation(('hybrid',
+                                  collaborative_based.current_model().version),
+                                 hybrid.hybrid_model, movie_list, top_n)
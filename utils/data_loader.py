@@ -4,11 +4,284 @@
 
     Author: Explore Data Science Academy.
 
+    Description: The MovieLens `.csv` files are converted once into a
+    columnar binary cache (one `.npy` file per column) stored in a
+    `.cache` directory next to the source file. Later loads open those
+    files memory-mapped, so startup does not re-parse the csv and
+    separate app processes share the same pages through the OS cache.
+    The cache is keyed by the size, modification time and hash of the
+    source file and is rebuilt whenever the source changes. A rebuilt
+    cache is written to a private folder and published by swapping a
+    symbolic link, so readers never see a missing or partial cache.
+
 """
 # Data handling dependencies
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
 import pandas as pd
 import numpy as np
 
+MOVIES_SCHEMA = {'movieId': 'int32', 'title': 'string', 'genres': 'category'}
+RATINGS_SCHEMA = {'userId': 'int32', 'movieId': 'int32',
+                  'rating': 'float32', 'timestamp': 'int64'}
+CACHE_FORMAT_VERSION = 1
+
+def _file_hash(path):
+    """Compute the SHA-1 digest of a file's contents."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _cache_dir(path):
+    """Directory holding the columnar cache of a source file."""
+    folder, name = os.path.split(os.path.abspath(path))
+    return os.path.join(folder, '.cache', os.path.splitext(name)[0])
+
+def staging_folder(target):
+    """Create a private folder to write a new version of `target` into.
+
+    The folder sits next to `target`, its name is unique to the calling
+    process and thread, and names sort by creation time.
+
+    """
+    parent, name = os.path.split(os.path.abspath(target))
+    os.makedirs(parent, exist_ok=True)
+    folder = os.path.join(parent, '{}.v{:020d}-{}-{}'.format(
+        name, time.time_ns(), os.getpid(), threading.get_ident()))
+    os.makedirs(folder)
+    return folder
+
+def publish_folder(staging, target):
+    """Atomically make a complete folder from `staging_folder` current.
+
+    `target` becomes a symbolic link to `staging`, swapped in with
+    `os.replace`, so readers find either the previous version or the new
+    one. A version older than the one currently published is discarded
+    instead. The previous version is kept for readers still opening it;
+    older ones are removed. Where symbolic links are not available the
+    folder is renamed into place, leaving `target` briefly missing.
+
+    Parameters
+    ----------
+    staging : str
+        Complete folder returned by `staging_folder(target)`.
+    target : str
+        Path the readers open.
+
+    Returns
+    -------
+    bool
+        Whether `staging` was published.
+
+    """
+    target = os.path.abspath(target)
+    parent, name = os.path.split(target)
+    version = os.path.basename(staging)
+    previous = (os.path.basename(os.readlink(target))
+                if os.path.islink(target) else None)
+    if previous is not None and previous > version:
+        # A writer that started later has already published.
+        shutil.rmtree(staging, ignore_errors=True)
+        return False
+    link = '{}.link-{}-{}'.format(target, os.getpid(), threading.get_ident())
+    try:
+        if os.path.lexists(link):
+            os.remove(link)
+        os.symlink(version, link, target_is_directory=True)
+    except (OSError, NotImplementedError):
+        link = None
+    retired = None
+    if os.path.isdir(target) and previous is None:
+        # A plain folder, as written before links were used or where
+        # they are not available.
+        retired = '{}.old-{}-{}'.format(target, os.getpid(),
+                                        threading.get_ident())
+        try:
+            os.rename(target, retired)
+        except OSError:
+            retired = None
+    try:
+        if link is None:
+            os.rename(staging, target)
+        else:
+            os.replace(link, target)
+    except OSError:
+        # Another writer published a plain folder first.
+        shutil.rmtree(staging, ignore_errors=True)
+        return False
+    finally:
+        if retired is not None:
+            shutil.rmtree(retired, ignore_errors=True)
+    if previous is not None:
+        for old in os.listdir(parent):
+            if old.startswith(name + '.v') and old < previous:
+                shutil.rmtree(os.path.join(parent, old), ignore_errors=True)
+    return True
+
+def _cached_meta(target, schema, path, stat, sha1=None):
+    """Header of the cache in `target` if it is valid for the source file."""
+    try:
+        with open(os.path.join(target, 'meta.json')) as meta_file:
+            meta = json.load(meta_file)
+    except (OSError, ValueError):
+        return None
+    if (meta.get('version') != CACHE_FORMAT_VERSION
+            or meta.get('schema') != schema or meta['size'] != stat.st_size):
+        return None
+    if meta['mtime_ns'] == stat.st_mtime_ns:
+        return meta
+    # A touched but unchanged file does not need converting again.
+    if meta['sha1'] == (sha1 or _file_hash(path)):
+        return meta
+    return None
+
+def _write_columns(df, schema, target):
+    """Write each column of `df` to `target` in its cached representation."""
+    meta = {'columns': {}}
+    for column, kind in schema.items():
+        if kind == 'category':
+            values = df[column].astype('category')
+            categories = values.cat.categories.tolist()
+            code_dtype = np.int16 if len(categories) < 2 ** 15 else np.int32
+            np.save(os.path.join(target, column + '.codes.npy'),
+                    values.cat.codes.to_numpy().astype(code_dtype))
+            meta['columns'][column] = {'kind': kind, 'categories': categories}
+        elif kind == 'string':
+            values = df[column]
+            missing = values.isna().to_numpy()
+            encoded = [b'' if gone else str(value).encode('utf-8')
+                       for value, gone in zip(values.tolist(), missing)]
+            offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(item) for item in encoded])
+            blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+            np.save(os.path.join(target, column + '.bytes.npy'), blob)
+            np.save(os.path.join(target, column + '.offsets.npy'), offsets)
+            if missing.any():
+                np.save(os.path.join(target, column + '.missing.npy'), missing)
+            meta['columns'][column] = {'kind': kind,
+                                       'has_missing': bool(missing.any())}
+        else:
+            np.save(os.path.join(target, column + '.npy'),
+                    df[column].to_numpy(dtype=kind))
+            meta['columns'][column] = {'kind': kind}
+    return meta
+
+def _read_columns(target, meta):
+    """Open the cached columns in `target` as a Pandas Dataframe."""
+    columns = {}
+    for column, info in meta['columns'].items():
+        kind = info['kind']
+        if kind == 'category':
+            codes = np.load(os.path.join(target, column + '.codes.npy'),
+                            mmap_mode='r')
+            columns[column] = pd.Categorical.from_codes(
+                codes, categories=info['categories'])
+        elif kind == 'string':
+            blob = np.load(os.path.join(target, column + '.bytes.npy'),
+                           mmap_mode='r')
+            offsets = np.load(os.path.join(target, column + '.offsets.npy'),
+                              mmap_mode='r').tolist()
+            text = blob.tobytes()
+            values = [text[start:end].decode('utf-8')
+                      for start, end in zip(offsets[:-1], offsets[1:])]
+            series = pd.Series(values, dtype=object)
+            if info['has_missing']:
+                missing = np.load(os.path.join(target, column + '.missing.npy'))
+                series[missing] = np.nan
+            columns[column] = series.to_numpy()
+        else:
+            columns[column] = np.load(os.path.join(target, column + '.npy'),
+                                      mmap_mode='r')
+    return pd.DataFrame(columns, copy=False)
+
+def load_columnar(path, schema):
+    """Load a .csv file through its memory-mapped columnar cache.
+
+    Parameters
+    ----------
+    path : str
+        Relative or absolute path to the source .csv file.
+    schema : dict
+        Maps each column to load onto its cached type: a NumPy dtype
+        name, 'category' or 'string'.
+
+    Returns
+    -------
+    Pandas Dataframe
+        The requested columns. Numeric columns are read-only views of
+        the memory-mapped cache files.
+
+    """
+    stat = os.stat(path)
+    target = _cache_dir(path)
+    meta = _cached_meta(target, schema, path, stat)
+    if meta is not None:
+        return _read_columns(target, meta)
+
+    df = pd.read_csv(path, usecols=list(schema))
+    sha1 = _file_hash(path)
+    # Another thread or process may have converted the file meanwhile.
+    published = _cached_meta(target, schema, path, stat, sha1)
+    if published is not None:
+        return _read_columns(target, published)
+    # Convert into a private directory first, then swap it into place so
+    # concurrent loads never observe a missing or half-written cache.
+    staging = staging_folder(target)
+    meta = _write_columns(df, schema, staging)
+    meta.update(version=CACHE_FORMAT_VERSION, schema=schema,
+                size=stat.st_size, mtime_ns=stat.st_mtime_ns, sha1=sha1)
+    with open(os.path.join(staging, 'meta.json'), 'w') as meta_file:
+        json.dump(meta, meta_file)
+    if publish_folder(staging, target):
+        return _read_columns(target, meta)
+    published = _cached_meta(target, schema, path, stat, sha1)
+    if published is not None:
+        return _read_columns(target, published)
+    # The published cache is of another version of the file.
+    return df.astype({column: kind for column, kind in schema.items()
+                      if kind != 'string'})
+
+def load_movies(path_to_movies='resources/data/movies.csv'):
+    """Load the movie database records.
+
+    Parameters
+    ----------
+    path_to_movies : str
+        Relative or absolute path to movie database stored
+        in .csv format.
+
+    Returns
+    -------
+    Pandas Dataframe
+        `movieId` (int32), `title` and `genres` (categorical) columns.
+
+    """
+    return load_columnar(path_to_movies, MOVIES_SCHEMA)
+
+def load_ratings(path_to_ratings='resources/data/ratings.csv'):
+    """Load the user rating records.
+
+    Parameters
+    ----------
+    path_to_ratings : str
+        Relative or absolute path to rating records stored
+        in .csv format.
+
+    Returns
+    -------
+    Pandas Dataframe
+        `userId` and `movieId` (int32), `rating` (float32) and
+        `timestamp` (int64) columns.
+
+    """
+    return load_columnar(path_to_ratings, RATINGS_SCHEMA)
+
 def load_movie_titles(path_to_movies):
     """Load movie titles from database records.
 
@@ -24,7 +297,7 @@ def load_movie_titles(path_to_movies):
         Movie titles.
 
     """
-    df = pd.read_csv(path_to_movies)
+    df = load_movies(path_to_movies)
     df = df.dropna()
     movie_list = df['title'].to_list()
     return movie_list
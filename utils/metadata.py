@@ -0,0 +1,262 @@
+"""
+
+    Movie metadata lookups against the OMDb API.
+
+    Author: Explore Data Science Academy.
+
+    Description: Lookups reuse one pooled `requests.Session`, run
+    concurrently on a thread pool with a per-request timeout, and are
+    stored in a persistent on-disk LRU cache (SQLite) keyed by the
+    cleaned title. Cache entries expire after a configurable time to
+    live. The API location is configurable so that the service can be
+    pointed at a local stub server.
+
+"""
+# Dependencies
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+
+OMDB_URL = 'http://www.omdbapi.com/'
+OMDB_API_KEY = os.environ.get('OMDB_API_KEY', '87d991ea')
+CACHE_PATH = 'resources/data/.cache/omdb_metadata.sqlite'
+
+logger = logging.getLogger(__name__)
+
+# Matches the non-alphabetical characters removed from titles.
+_NON_ALPHA = re.compile('[^a-zA-Z ]')
+
+def clean_title(title):
+    """Remove non-alphabetical characters from a movie title.
+
+    Parameters
+    ----------
+    title : str
+        Movie title, e.g. 'Toy Story (1995)'.
+
+    Returns
+    -------
+    str
+        The title with only letters and spaces, e.g. 'Toy Story '.
+
+    """
+    return _NON_ALPHA.sub('', title)
+
+class MetadataCache:
+    """Persistent LRU cache of metadata records with TTL-based expiry.
+
+    Parameters
+    ----------
+    path : str
+        SQLite database file. Parent folders are created as needed.
+    ttl : float
+        Seconds after which a stored record is treated as missing.
+    max_entries : int
+        Number of records kept; the least recently used are evicted.
+
+    """
+    def __init__(self, path=CACHE_PATH, ttl=7 * 24 * 3600, max_entries=50000):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS metadata ('
+                ' key TEXT PRIMARY KEY, value TEXT NOT NULL,'
+                ' stored_at REAL NOT NULL, used_at REAL NOT NULL)')
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS metadata_used_at'
+                ' ON metadata (used_at)')
+
+    def get(self, key):
+        """Look up a record, returning `None` when missing or expired."""
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                'SELECT value, stored_at FROM metadata WHERE key = ?',
+                (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                self._conn.execute('DELETE FROM metadata WHERE key = ?', (key,))
+                return None
+            self._conn.execute('UPDATE metadata SET used_at = ? WHERE key = ?',
+                               (now, key))
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        """Store a record, evicting the least recently used if full."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?)',
+                (key, json.dumps(value), now, now))
+            self._conn.execute(
+                'DELETE FROM metadata WHERE key IN (SELECT key FROM metadata'
+                ' ORDER BY used_at DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class MetadataService:
+    """Concurrent, cached OMDb metadata fetcher.
+
+    Parameters
+    ----------
+    api_key : str
+        OMDb API key.
+    base_url : str
+        OMDb endpoint; override to point at a stub server.
+    timeout : float
+        Per-request timeout in seconds.
+    max_workers : int
+        Number of lookups run concurrently, and size of the connection
+        pool.
+    cache : MetadataCache, optional
+        Persistent cache of results. Lookups are not cached if omitted.
+    poster_store : utils.poster_store.PosterStore, optional
+        Offline prefetched metadata and posters, consulted before any
+        network request.
+
+    """
+    def __init__(self, api_key=OMDB_API_KEY, base_url=OMDB_URL, timeout=3.0,
+                 max_workers=8, cache=None, poster_store=None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.timeout = timeout
+        self.cache = cache
+        self.poster_store = poster_store
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='omdb')
+
+    def lookup(self, title):
+        """Look up the metadata of a single movie, raising on failure.
+
+        Parameters
+        ----------
+        title : str
+            Movie title as stored in the MovieLens data.
+
+        Returns
+        -------
+        dict or None
+            The OMDb record, or None when the title is invalid or cannot
+            be found in the OMDb database.
+
+        Raises
+        ------
+        requests.RequestException
+            The request failed or timed out.
+        ValueError
+            The response was not valid JSON.
+
+        """
+        key = clean_title(title)
+        if not key:
+            return None
+        if self.poster_store is not None:
+            stored = self.poster_store.lookup(title)
+            if stored is not None:
+                return stored or None
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached or None
+        response = self.session.get(
+            self.base_url, params={'t': key, 'apikey': self.api_key},
+            timeout=self.timeout)
+        response.raise_for_status()
+        record = response.json()
+        if record.get('Response') == 'False':
+            # Remember titles OMDb does not know so they are not retried.
+            record = {}
+        if self.cache is not None:
+            self.cache.set(key, record)
+        return record or None
+
+    def fetch(self, title):
+        """Fetch the metadata of a single movie.
+
+        Parameters
+        ----------
+        title : str
+            Movie title as stored in the MovieLens data.
+
+        Returns
+        -------
+        dict or None
+            The OMDb record, or None when the title is invalid, cannot be
+            found in the OMDb database or the request failed.
+
+        """
+        try:
+            return self.lookup(title)
+        except (requests.RequestException, ValueError) as error:
+            logger.warning('Metadata lookup for %r failed: %s', title, error)
+            return None
+
+    def fetch_many(self, titles):
+        """Fetch the metadata of several movies concurrently.
+
+        Parameters
+        ----------
+        titles : list (str)
+            Movie titles to look up.
+
+        Yields
+        ------
+        tuple (int, str, dict or None)
+            Position within `titles`, the title and its metadata, in the
+            order the lookups complete.
+
+        """
+        futures = {self._executor.submit(self.fetch, title): (position, title)
+                   for position, title in enumerate(titles)}
+        for future in as_completed(futures):
+            position, title = futures[future]
+            yield position, title, future.result()
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.session.close()
+
+_default_service = None
+_default_service_lock = threading.Lock()
+
+def get_metadata_service():
+    """Return the process-wide metadata service, creating it on first use.
+
+    Returns
+    -------
+    MetadataService
+        Service backed by the on-disk cache at `CACHE_PATH` and, when it
+        has been prefetched, the local poster store.
+
+    """
+    # Imported here as the prefetch pipeline builds on this module.
+    from utils.poster_store import get_poster_store
+
+    global _default_service
+    with _default_service_lock:
+        if _default_service is None:
+            _default_service = MetadataService(
+                cache=MetadataCache(), poster_store=get_poster_store())
+        return _default_service
@@ -0,0 +1,277 @@
+"""
+
+    Offline poster and metadata prefetch pipeline.
+
+    Author: Explore Data Science Academy.
+
+    Description: Walks the movie catalogue, resolves the metadata of each
+    title through a pluggable fetcher, downloads its poster, shrinks it to
+    a thumbnail and writes it to a content-addressed local store
+    (`objects/<sha[:2]>/<sha>.jpg`). One append-only index file maps each
+    cleaned title to its metadata and local poster. Re-running the
+    pipeline skips titles already in the index, so an interrupted run can
+    simply be resumed.
+
+    Usage:
+
+        python -m utils.poster_store --workers 8
+
+"""
+# Dependencies
+import argparse
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import requests
+
+from utils.data_loader import load_movie_titles
+from utils.metadata import MetadataCache, MetadataService, clean_title
+
+try:
+    from PIL import Image
+except ImportError:  # Posters are stored as downloaded without Pillow.
+    Image = None
+
+POSTER_STORE_PATH = 'resources/posters'
+THUMBNAIL_SIZE = (300, 445)
+
+logger = logging.getLogger(__name__)
+
+def make_thumbnail(image_bytes, size=THUMBNAIL_SIZE, quality=80):
+    """Resize and recompress a poster image.
+
+    Parameters
+    ----------
+    image_bytes : bytes
+        Encoded source image.
+    size : tuple (int, int)
+        Bounding box of the thumbnail; the aspect ratio is kept.
+    quality : int
+        JPEG quality of the recompressed image.
+
+    Returns
+    -------
+    bytes
+        The JPEG thumbnail, or `image_bytes` unchanged when Pillow is
+        not installed.
+
+    """
+    if Image is None:
+        return image_bytes
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        image = image.convert('RGB')
+        image.thumbnail(size)
+        out = io.BytesIO()
+        image.save(out, format='JPEG', quality=quality, optimize=True)
+    return out.getvalue()
+
+class PosterStore:
+    """Content-addressed poster store with a title index.
+
+    Parameters
+    ----------
+    root : str
+        Folder holding the `objects/` tree and `index.jsonl`.
+
+    """
+    def __init__(self, root=POSTER_STORE_PATH):
+        self.root = root
+        self.index_path = os.path.join(root, 'index.jsonl')
+        self._lock = threading.Lock()
+        self._index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, encoding='utf-8') as index_file:
+                for line in index_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A torn final line from an interrupted run.
+                        continue
+                    self._index[entry['key']] = entry
+
+    def __contains__(self, title):
+        return clean_title(title) in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def put_image(self, image_bytes):
+        """Store an image under its content hash.
+
+        Parameters
+        ----------
+        image_bytes : bytes
+            Encoded image.
+
+        Returns
+        -------
+        str
+            Path of the stored image, relative to the store root.
+
+        """
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        relative = os.path.join('objects', digest[:2], digest + '.jpg')
+        path = os.path.join(self.root, relative)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = '{}.tmp-{}'.format(path, threading.get_ident())
+            with open(tmp_path, 'wb') as image_file:
+                image_file.write(image_bytes)
+            os.replace(tmp_path, path)
+        return relative
+
+    def add(self, title, metadata, poster=None):
+        """Record the metadata and stored poster of a title.
+
+        Parameters
+        ----------
+        title : str
+            Movie title.
+        metadata : dict or None
+            Metadata record; None marks a title the fetcher could not
+            resolve.
+        poster : str, optional
+            Poster path returned by `put_image`.
+
+        """
+        entry = {'key': clean_title(title), 'metadata': metadata,
+                 'poster': poster}
+        with self._lock:
+            os.makedirs(self.root, exist_ok=True)
+            with open(self.index_path, 'a', encoding='utf-8') as index_file:
+                index_file.write(json.dumps(entry) + '\n')
+            self._index[entry['key']] = entry
+
+    def lookup(self, title):
+        """Look up the stored metadata of a title without any network.
+
+        Parameters
+        ----------
+        title : str
+            Movie title.
+
+        Returns
+        -------
+        dict or None
+            The metadata record with `Poster` pointing at the local
+            thumbnail, `{}` for titles known to be unresolvable, or None
+            when the title has not been prefetched.
+
+        """
+        entry = self._index.get(clean_title(title))
+        if entry is None:
+            return None
+        record = dict(entry['metadata'] or {})
+        if entry['poster']:
+            record['Poster'] = os.path.join(self.root, entry['poster'])
+        return record
+
+def prefetch_title(title, fetcher, store, session, timeout=10.0):
+    """Resolve one title and store its metadata and poster thumbnail.
+
+    Parameters
+    ----------
+    title : str
+        Movie title.
+    fetcher : callable
+        Maps a title onto its metadata dict, or None if unknown. Errors
+        raised by the fetcher leave the title out of the store so that
+        it is retried on the next run.
+    store : PosterStore
+        Destination store.
+    session : requests.Session
+        Session used to download posters.
+    timeout : float
+        Poster download timeout in seconds.
+
+    """
+    metadata = fetcher(title)
+    poster = None
+    url = (metadata or {}).get('Poster', 'N/A')
+    if url.startswith('http'):
+        try:
+            response = session.get(url, timeout=timeout)
+            response.raise_for_status()
+            poster = store.put_image(make_thumbnail(response.content))
+        except (requests.RequestException, OSError) as error:
+            logger.warning('Poster download for %r failed: %s', title, error)
+            return
+    store.add(title, metadata, poster)
+
+def prefetch(titles, fetcher, store, max_workers=8):
+    """Prefetch metadata and posters for many titles in parallel.
+
+    Parameters
+    ----------
+    titles : iterable (str)
+        Movie titles; titles already in `store` are skipped.
+    fetcher : callable
+        Maps a title onto its metadata dict, or None if unknown.
+    store : PosterStore
+        Destination store.
+    max_workers : int
+        Number of titles processed concurrently. At most twice this
+        many titles are queued at any time.
+
+    Returns
+    -------
+    int
+        Number of titles processed.
+
+    """
+    def collect(done):
+        for future in done:
+            if future.exception() is not None:
+                logger.error('Prefetch failed: %s', future.exception())
+        return len(done)
+
+    session = requests.Session()
+    pending = set()
+    submitted = set()
+    processed = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for title in titles:
+            key = clean_title(title)
+            if not key or key in submitted or title in store:
+                continue
+            submitted.add(key)
+            if len(pending) >= 2 * max_workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                processed += collect(done)
+            pending.add(executor.submit(prefetch_title, title, fetcher,
+                                        store, session))
+        processed += collect(wait(pending).done)
+    session.close()
+    return processed
+
+_default_store = None
+
+def get_poster_store():
+    """Return the process-wide poster store, or None if never prefetched."""
+    global _default_store
+    if _default_store is None and os.path.exists(
+            os.path.join(POSTER_STORE_PATH, 'index.jsonl')):
+        _default_store = PosterStore()
+    return _default_store
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Prefetch movie metadata and poster thumbnails.')
+    parser.add_argument('--movies', default='resources/data/movies.csv')
+    parser.add_argument('--store', default=POSTER_STORE_PATH)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--limit', type=int, default=None,
+                        help='Only process the first LIMIT titles.')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    service = MetadataService(max_workers=args.workers, cache=MetadataCache())
+    store = PosterStore(args.store)
+    titles = load_movie_titles(args.movies)[:args.limit]
+    count = prefetch(titles, service.lookup, store, max_workers=args.workers)
+    print(f"Prefetched {count} titles; {len(store)} titles in {args.store}")
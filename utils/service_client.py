@@ -0,0 +1,85 @@
+"""
+
+    Client of the headless recommendation service.
+
+    Author: Explore Data Science Academy.
+
+    Description: A thin wrapper around `recommenders.service`'s JSON API.
+    Requests reuse one pooled `requests.Session`. When the
+    `RECOMMENDER_SERVICE_URL` environment variable is set, the app sends
+    its recommendation requests to that service instead of loading the
+    recommenders in the Streamlit process.
+
+"""
+# Dependencies
+import os
+
+import requests
+from requests.adapters import HTTPAdapter
+
+SERVICE_URL = os.environ.get('RECOMMENDER_SERVICE_URL')
+
+class RecommenderClient:
+    """Client of one recommendation service.
+
+    Parameters
+    ----------
+    base_url : str
+        Service location, e.g. 'http://127.0.0.1:8600'.
+    timeout : float
+        Seconds to wait for a response.
+    pool_size : int
+        Number of connections kept open to the service.
+
+    """
+    def __init__(self, base_url, timeout=30.0, pool_size=16):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def recommend(self, algorithm, movie_list, top_n=10):
+        """Request recommendations for one list of favourite movies.
+
+        Parameters
+        ----------
+        algorithm : str
+            'content', 'collaborative' or 'hybrid'.
+        movie_list : list (str)
+            Favorite movies chosen by the app user.
+        top_n : int
+            Number of top recommendations to return.
+
+        Returns
+        -------
+        list (str)
+            Titles of the top-n movie recommendations.
+
+        """
+        response = self.session.post(
+            self.base_url + '/recommend',
+            json={'algorithm': algorithm, 'movies': list(movie_list),
+                  'top_n': top_n},
+            timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()['recommendations']
+
+    def health(self):
+        """Whether the service is up and answering."""
+        try:
+            response = self.session.get(self.base_url + '/health',
+                                        timeout=self.timeout)
+        except requests.RequestException:
+            return False
+        return response.ok
+
+_client = None
+
+def get_service_client():
+    """Return the client of `RECOMMENDER_SERVICE_URL`, or None if unset."""
+    global _client
+    if SERVICE_URL and _client is None:
+        _client = RecommenderClient(SERVICE_URL)
+    return _client
@@ -0,0 +1,164 @@
+"""
+
+    Movie title search.
+
+    Author: Explore Data Science Academy.
+
+    Description: Titles are normalised (accents, case and punctuation
+    removed, and trailing articles such as 'Matrix, The' moved to the
+    front) and indexed in two ways: a dictionary resolving exact and
+    normalised titles to their position in O(1), and a character trigram
+    inverted index used for fuzzy typeahead search. A query is scored
+    against every title sharing one of its trigrams with a single
+    `np.bincount`, so a search over the full catalogue takes a few
+    milliseconds. The trigram index is only built on the first search.
+
+"""
+# Dependencies
+import re
+import threading
+import unicodedata
+
+import numpy as np
+
+from recommenders.ranking import top_k
+
+_NON_ALNUM = re.compile('[^a-z0-9]+')
+# 'Matrix, The (1999)' -> 'The Matrix (1999)'
+_TRAILING_ARTICLE = re.compile(
+    r'^(.*?), (the|a|an|les|la|le|l\'|el|il|die|der|das)(\s*\(.*)?$')
+
+def normalise_title(title):
+    """Reduce a title to lowercase ASCII words.
+
+    Parameters
+    ----------
+    title : str
+        Movie title, e.g. 'Matrix, The (1999)'.
+
+    Returns
+    -------
+    str
+        The normalised title, e.g. 'the matrix 1999'.
+
+    """
+    text = unicodedata.normalize('NFKD', str(title))
+    text = text.encode('ascii', 'ignore').decode('ascii').lower().strip()
+    match = _TRAILING_ARTICLE.match(text)
+    if match:
+        text = '{} {}{}'.format(match.group(2), match.group(1),
+                                match.group(3) or '')
+    return ' '.join(_NON_ALNUM.sub(' ', text).split())
+
+def _trigrams(text):
+    padded = f' {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class TitleIndex:
+    """Exact and fuzzy lookup of movie titles.
+
+    Parameters
+    ----------
+    titles : sequence (str)
+        Movie titles; positions in this sequence are what lookups return.
+
+    """
+    def __init__(self, titles):
+        self.titles = np.asarray(titles, dtype=object)
+        self.normalised = [normalise_title(title) for title in self.titles]
+        # Keep the first occurrence of duplicated titles.
+        self._exact = {}
+        self._normalised = {}
+        for position, (title, normalised) in enumerate(
+                zip(self.titles.tolist(), self.normalised)):
+            self._exact.setdefault(title, position)
+            self._normalised.setdefault(normalised, position)
+        self._postings = None
+        self._gram_counts = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.titles)
+
+    def lookup(self, title):
+        """Find the position of a title.
+
+        Parameters
+        ----------
+        title : str
+            A title, matched exactly or else after normalisation.
+
+        Returns
+        -------
+        int or None
+            Position of the title, or None if it is not in the index.
+
+        """
+        position = self._exact.get(title)
+        if position is None:
+            position = self._normalised.get(normalise_title(title))
+        return position
+
+    def _build_postings(self):
+        with self._lock:
+            if self._postings is not None:
+                return
+            postings = {}
+            gram_counts = np.empty(len(self.normalised), dtype=np.int32)
+            for position, normalised in enumerate(self.normalised):
+                grams = _trigrams(normalised)
+                gram_counts[position] = len(grams)
+                for gram in grams:
+                    postings.setdefault(gram, []).append(position)
+            self._gram_counts = gram_counts
+            self._postings = {gram: np.array(positions, dtype=np.int32)
+                              for gram, positions in postings.items()}
+
+    def search(self, query, limit=10):
+        """Find the titles best matching a (partial, misspelt) query.
+
+        Titles are ranked by the trigram overlap (Jaccard) with the query,
+        with a bonus for titles starting with the query and a smaller one
+        for titles containing a word starting with it.
+
+        Parameters
+        ----------
+        query : str
+            Text typed by the user.
+        limit : int
+            Maximum number of titles returned.
+
+        Returns
+        -------
+        list (str)
+            Matching titles, best first.
+
+        """
+        normalised = normalise_title(query)
+        if not normalised:
+            return []
+        if self._postings is None:
+            self._build_postings()
+        grams = [gram for gram in _trigrams(normalised) if gram in self._postings]
+        if not grams:
+            return []
+        shared = np.bincount(
+            np.concatenate([self._postings[gram] for gram in grams]),
+            minlength=len(self.titles))
+        n_query = len(_trigrams(normalised))
+        scores = shared / (n_query + self._gram_counts - shared)
+        # Re-rank a shortlist of the closest titles with the prefix bonuses.
+        shortlist = top_k(scores, max(limit * 20, 200))
+        ranked = []
+        for position in shortlist.tolist():
+            if shared[position] == 0:
+                break
+            title = self.normalised[position]
+            bonus = 0.0
+            if title.startswith(normalised):
+                bonus = 1.0
+            elif f' {normalised}' in f' {title}':
+                bonus = 0.5
+            ranked.append((-(scores[position] + bonus), position))
+        ranked.sort()
+        return [self.titles[position] for _, position in ranked[:limit]]
@@ -0,0 +1,212 @@
+"""
+
+    Lightweight request tracing for the recommender app.
+
+    Author: Explore Data Science Academy.
+
+    Description: Times the stages of a request (recommender calls, model
+    scoring, metadata fetching) as nested spans. Each app run is traced
+    as one request: its spans are written as a single JSON line to the
+    `recommender.trace` logger, kept for the sidebar debug panel and,
+    optionally, accompanied by a cProfile dump of the whole run.
+
+    Tracing is switched on with the `RECOMMENDER_TRACE` environment
+    variable and profiling with `RECOMMENDER_PROFILE_DIR` (the folder the
+    `.prof` files are written to). Errors raised inside `reported_errors`
+    blocks are always logged with their traceback, even where the app
+    goes on to show a generic message. When tracing is off, `traced` returns
+    functions undecorated and `span` returns a shared no-op context, so
+    the instrumentation costs next to nothing.
+
+"""
+# Dependencies
+import contextvars
+import cProfile
+import functools
+import json
+import logging
+import os
+import time
+import traceback
+from contextlib import contextmanager, nullcontext
+
+logger = logging.getLogger('recommender.trace')
+
+TRACING_ENABLED = os.environ.get('RECOMMENDER_TRACE', '') not in ('', '0')
+PROFILE_DIR = os.environ.get('RECOMMENDER_PROFILE_DIR')
+
+if TRACING_ENABLED and not logger.handlers:
+    # Emit trace records even if the app has not configured logging.
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.INFO)
+
+_NO_SPAN = nullcontext()
+# Trace of the request being served by the current thread, if any.
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+
+class Trace:
+    """Spans recorded while serving one request.
+
+    Parameters
+    ----------
+    name : str
+        Name of the request.
+
+    """
+    def __init__(self, name):
+        self.name = name
+        self.spans = []
+        self.errors = []
+        self.profile_path = None
+        self._depth = 0
+        self._start = time.perf_counter()
+        self._end = None
+
+    @property
+    def duration_ms(self):
+        end = time.perf_counter() if self._end is None else self._end
+        return (end - self._start) * 1000
+
+    def records(self):
+        """Spans in start order, with offsets and durations in ms."""
+        return sorted(self.spans, key=lambda record: record['start_ms'])
+
+    def to_json(self):
+        return json.dumps({'request': self.name,
+                           'duration_ms': round(self.duration_ms, 3),
+                           'spans': self.records(),
+                           'errors': self.errors,
+                           'profile': self.profile_path})
+
+@contextmanager
+def _span(trace, name, fields):
+    start = time.perf_counter()
+    record = {'name': name, 'depth': trace._depth,
+              'start_ms': round((start - trace._start) * 1000, 3)}
+    record.update(fields)
+    trace._depth += 1
+    try:
+        yield record
+    except BaseException as error:
+        record['error'] = repr(error)
+        raise
+    finally:
+        trace._depth -= 1
+        record['duration_ms'] = round((time.perf_counter() - start) * 1000, 3)
+        trace.spans.append(record)
+
+def span(name, **fields):
+    """Time a block of code as a stage of the current request.
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage.
+    **fields
+        Extra JSON-serialisable attributes recorded with the span.
+
+    Returns
+    -------
+    context manager
+        Yields the span's record dict (or None when not tracing), to
+        which further attributes can be added.
+
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return _NO_SPAN
+    return _span(trace, name, fields)
+
+def traced(name=None):
+    """Decorator recording every call of a function as a span.
+
+    Parameters
+    ----------
+    name : str, optional
+        Span name; defaults to the function's name.
+
+    Returns
+    -------
+    callable
+        The decorator. When tracing is disabled it returns the function
+        unchanged.
+
+    """
+    def decorate(function):
+        if not TRACING_ENABLED:
+            return function
+        span_name = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            trace = _current_trace.get()
+            if trace is None:
+                return function(*args, **kwargs)
+            with _span(trace, span_name, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+@contextmanager
+def request_trace(name):
+    """Trace one request, logging its spans when it finishes.
+
+    Requests in which no span or error was recorded are not logged or
+    profiled.
+
+    Parameters
+    ----------
+    name : str
+        Name of the request.
+
+    Yields
+    ------
+    Trace or None
+        The request's trace, or None when tracing is disabled.
+
+    """
+    if not TRACING_ENABLED:
+        yield None
+        return
+    trace = Trace(name)
+    token = _current_trace.set(trace)
+    profiler = cProfile.Profile() if PROFILE_DIR else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield trace
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        trace._end = time.perf_counter()
+        _current_trace.reset(token)
+        if trace.spans or trace.errors:
+            if profiler is not None:
+                os.makedirs(PROFILE_DIR, exist_ok=True)
+                trace.profile_path = os.path.join(
+                    PROFILE_DIR, '{}-{}.prof'.format(name, time.time_ns()))
+                profiler.dump_stats(trace.profile_path)
+            logger.info(trace.to_json())
+
+@contextmanager
+def reported_errors(stage):
+    """Log any exception raised in a block before re-raising it.
+
+    The exception and its traceback are also attached to the current
+    request's trace, for the debug panel.
+
+    Parameters
+    ----------
+    stage : str
+        Name of the stage, used in the log message.
+
+    """
+    try:
+        yield
+    except Exception as error:
+        logger.exception('%s failed', stage)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.errors.append({'stage': stage, 'error': repr(error),
+                                 'traceback': traceback.format_exc()})
+        raise